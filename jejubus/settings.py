@@ -127,3 +127,74 @@ ROUTE_TYPES = [
     "seogwiLocal", "seogwiPublic", "limousine", "night", "lowbus",
     "seogwiCityTour", "jejuCityTour", "village"
 ]
+
+# Seconds between checks for a newly published dataset version.
+DATASET_CHECK_INTERVAL = 5
+
+# updatedb builds the new dataset in a copy of the database and refuses to
+# swap it in when a table has fewer than this fraction of the current rows,
+# unless run with --force.
+DATASET_MIN_ROW_RATIO = 0.5
+
+# Number of rows handed to each bulk_create call by updatedb.
+BULK_CHUNK_SIZE = 2000
+
+BUS_SCHEDULE_URL = 'http://bus.jeju.go.kr/publicTrafficInformation/downloadSchedule/'
+BUS_OPEN_API_URL = 'http://busopen.jeju.go.kr/OpenAPI/service/bis/'
+
+# Download settings used by updatedb.
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 0.5
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'main.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Upper bound for the page_size query parameter.
+MAX_PAGE_SIZE = 1000
+
+# max-age of the Cache-Control header sent with dataset-versioned responses.
+API_CACHE_MAX_AGE = 300
+
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+#
+# 'responses' holds rendered API responses keyed by dataset version. The
+# local-memory backend evicts least recently used entries once MAX_ENTRIES
+# is reached; point it at a file-based or shared backend to share entries
+# between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+RESPONSE_CACHE = 'responses'
+
+# Rows fetched per database round trip when streaming a list response.
+STREAM_CHUNK_SIZE = 2000
+
+# Binary timetable snapshot written by updatedb and memory-mapped by the
+# API workers. Set to None to disable it.
+TIMETABLE_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'timetable.snapshot')
+
+# Walking transfers computed by updatedb: station pairs within
+# TRANSFER_RADIUS meters, or within TRANSFER_SAME_NAME_RADIUS meters when
+# they share a name or synonym. Walk times assume WALKING_SPEED m/s over a
+# path TRANSFER_DETOUR times the straight-line distance.
+TRANSFER_RADIUS = 300
+TRANSFER_SAME_NAME_RADIUS = 1000
+WALKING_SPEED = 1.2
+TRANSFER_DETOUR = 1.3
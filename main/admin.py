@@ -1,9 +1,17 @@
 from django.contrib import admin
 
-from .models import (Route, Station, StationSynonym, StationRoute, Time)
+from .models import (Dataset, Departure, Route, RouteHeadway, RouteSegment, RouteSummary, Station, StationSynonym,
+                     StationRoute, Time, Transfer, Trip)
 
 admin.site.register(Station)
 admin.site.register(StationSynonym)
 admin.site.register(StationRoute)
 admin.site.register(Route)
+admin.site.register(Trip)
 admin.site.register(Time)
+admin.site.register(Departure)
+admin.site.register(RouteSummary)
+admin.site.register(RouteHeadway)
+admin.site.register(RouteSegment)
+admin.site.register(Transfer)
+admin.site.register(Dataset)
@@ -0,0 +1,92 @@
+import calendar
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from .dataset import current_dataset
+
+
+def normalize_query(request):
+    return urlencode(sorted((key, value) for key, values in request.GET.lists()
+                            for value in values))
+
+
+def get_request_hash(request, version):
+    # Responses embed absolute next links, so the scheme and host are part
+    # of the key.
+    key = '\n'.join([version, request.scheme, request.get_host(), request.path, request.META.get(
+        'HTTP_ACCEPT', ''), normalize_query(request)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_etag(request, version):
+    return '"{}"'.format(get_request_hash(request, version))
+
+
+class ConditionalGetMixin:
+    """Adds ETag/Last-Modified/Cache-Control headers derived from the
+    current dataset version, and answers conditional GETs with 304 before
+    the handler runs.
+
+    Only ``conditional_actions`` are covered, since other actions may
+    depend on more than the dataset and the query parameters.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        dataset = current_dataset()
+        if action not in self.conditional_actions or dataset is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = get_etag(request, dataset.version)
+        last_modified = calendar.timegm(dataset.published_at.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, public=True,
+                            max_age=settings.API_CACHE_MAX_AGE)
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class ResponseCacheMixin:
+    """Serves rendered responses from the ``RESPONSE_CACHE`` cache.
+
+    Entries are keyed by dataset version, scheme, host, path, Accept
+    header and normalized query string, so publishing a new dataset makes every old
+    entry unreachable; the cache backend's own culling evicts them. Only
+    JSON responses are stored, because the browsable API embeds
+    per-user content.
+    """
+    cached_actions = ('list', 'retrieve')
+    cached_formats = ('json',)
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        dataset = current_dataset()
+        if action not in self.cached_actions or dataset is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = caches[settings.RESPONSE_CACHE]
+        key = 'response:' + get_request_hash(request, dataset.version)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = super().dispatch(request, *args, **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if response.status_code == 200 and renderer is not None and renderer.format in self.cached_formats:
+            response.render()
+            cache.set(key, (response.content, response['Content-Type']))
+        return response
@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Dataset, Departure, Route, Station, StationRoute, StationSynonym, Transfer
+
+_lock = threading.Lock()
+_checked_at = None
+_dataset = None
+
+
+def current_dataset():
+    """Return the most recently published Dataset, or None.
+
+    The lookup hits the database at most once every
+    ``DATASET_CHECK_INTERVAL`` seconds per process.
+    """
+    global _checked_at, _dataset
+    now = time.monotonic()
+    if _checked_at is None or now - _checked_at >= settings.DATASET_CHECK_INTERVAL:
+        with _lock:
+            if _checked_at is None or now - _checked_at >= settings.DATASET_CHECK_INTERVAL:
+                _dataset = Dataset.objects.order_by('-id').first()
+                _checked_at = now
+    return _dataset
+
+
+def current_version():
+    dataset = current_dataset()
+    return dataset.version if dataset is not None else ''
+
+
+def compute_content_hash():
+    """SHA-256 over the routes, stations, station synonyms, station routes,
+    departures and transfers, independent of row ids."""
+    content_hash = hashlib.sha256()
+    querysets = [
+        Route.objects.values_list(
+            'route_id', 'route_type', 'route_number').order_by('route_id'),
+        Station.objects.values_list(
+            'station_id', 'station_name', 'local_x', 'local_y').order_by('station_id'),
+        StationSynonym.objects.values_list(
+            'station_id', 'synonym').order_by('station_id', 'synonym'),
+        StationRoute.objects.values_list(
+            'route_id', 'station_order', 'station_id', 'up_down_direction').order_by(
+            'route_id', 'station_order', 'station_id', 'up_down_direction'),
+        Departure.objects.values_list(
+            'route_id', 'station_order', 'station_id', 'up_down_direction', 'holiday_type', 'time').order_by(
+            'route_id', 'station_order', 'station_id', 'up_down_direction', 'holiday_type', 'time'),
+        Transfer.objects.values_list(
+            'from_station_id', 'to_station_id', 'distance', 'walk_time', 'same_name').order_by(
+            'from_station_id', 'to_station_id'),
+    ]
+    for queryset in querysets:
+        content_hash.update(queryset.model.__name__.encode('utf-8'))
+        for row in queryset.iterator():
+            content_hash.update('\x1f'.join(map(str, row)).encode('utf-8'))
+            content_hash.update(b'\x1e')
+    return content_hash.hexdigest()
+
+
+def publish(version=None, force=False):
+    """Stamp the loaded data with its content hash so that every worker
+    reloads its in-memory indexes and HTTP caches revalidate.
+
+    Publishing unchanged content keeps the current version, unless
+    ``force`` asks for a new publication date.
+    """
+    global _checked_at
+    version = version or compute_content_hash()
+    dataset = Dataset.objects.order_by('-id').first()
+    if force or dataset is None or dataset.version != version:
+        dataset = Dataset.objects.create(version=version)
+    _checked_at = None
+    return dataset
+
+
+class DatasetIndex:
+    """A per-process structure built by ``build`` and rebuilt whenever a new
+    dataset version is published."""
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        version = current_version()
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._value = self._build()
+                    self._version = version
+        return self._value
+
+    @property
+    def version(self):
+        return self._version
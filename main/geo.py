@@ -0,0 +1,113 @@
+"""Spatial lookups over station coordinates.
+
+Stations are bucketed into a uniform grid of ``CELL_SIZE`` degree cells,
+so a radius query only measures the stations of the few cells that
+overlap the radius's bounding box. The same grid drives the spatial join
+that finds walking transfers at ingest time. ``local_x`` is the
+longitude and ``local_y`` the latitude.
+"""
+import math
+import re
+
+from django.conf import settings
+
+from .dataset import DatasetIndex
+from .models import Route, Station, StationRoute
+from .search import normalize
+from .serializers import StationSerializer
+
+EARTH_RADIUS = 6371008.8  # meters
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+CELL_SIZE = 0.005  # degrees, about 550 m of latitude
+
+
+def distance(x1, y1, x2, y2):
+    """Great-circle distance in meters between two (longitude, latitude)
+    points."""
+    phi1, phi2 = math.radians(y1), math.radians(y2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(x2 - x1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
+
+
+def cell(x, y):
+    return math.floor(x / CELL_SIZE), math.floor(y / CELL_SIZE)
+
+
+class StationGrid:
+    """Stations bucketed by grid cell, with the routes serving each one.
+
+    ``rows`` are station dictionaries with at least ``station_id``,
+    ``local_x`` and ``local_y``.
+    """
+
+    def __init__(self, rows, routes=None):
+        self.rows = rows
+        self.routes = routes or {}
+        self.points = [(float(row['local_x']), float(row['local_y'])) for row in rows]
+        self.cells = {}
+        for i, (x, y) in enumerate(self.points):
+            self.cells.setdefault(cell(x, y), []).append(i)
+
+    @classmethod
+    def load(cls):
+        rows = list(Station.objects.values(
+            *StationSerializer.fields).order_by('station_id'))
+        route_numbers = dict(Route.objects.values_list('route_id', 'route_number'))
+        routes = {}
+        for station_id, route_id in StationRoute.objects.values_list(
+                'station_id', 'route_id').order_by('station_id', 'route_id').distinct():
+            routes.setdefault(station_id, []).append(
+                {'route_id': route_id, 'route_number': route_numbers.get(route_id)})
+        return cls(rows, routes)
+
+    def nearby(self, x, y, radius, limit=None):
+        """(distance, row) of the stations within ``radius`` meters of
+        (``x``, ``y``), nearest first."""
+        dy = radius / METERS_PER_DEGREE
+        dx = dy / max(math.cos(math.radians(y)), 1e-6)
+        min_cell, max_cell = cell(x - dx, y - dy), cell(x + dx, y + dy)
+        found = []
+        for cx in range(min_cell[0], max_cell[0] + 1):
+            for cy in range(min_cell[1], max_cell[1] + 1):
+                for i in self.cells.get((cx, cy), ()):
+                    d = distance(x, y, *self.points[i])
+                    if d <= radius:
+                        found.append((d, self.rows[i]['station_id'], i))
+        found.sort()
+        return [(d, self.rows[i]) for d, _, i in found[:limit]]
+
+
+def base_name(name):
+    """A station name without its direction or platform suffix, e.g.
+    ``제주시청(광양방면)`` -> ``제주시청``."""
+    return normalize(re.sub(r'[(\[].*$', '', name)) or normalize(name)
+
+
+def walking_transfers(rows, synonyms=()):
+    """Yield (from_station_id, to_station_id, distance, walk_time,
+    same_name) for every ordered pair of stations within walking distance.
+
+    Pairs sharing a base name or synonym, such as the stops on either side
+    of a road, may be up to ``TRANSFER_SAME_NAME_RADIUS`` apart; any other
+    pair up to ``TRANSFER_RADIUS``.
+    """
+    grid = StationGrid(rows)
+    names = {row['station_id']: {base_name(row['station_name'])} for row in rows}
+    for station_id, synonym in synonyms:
+        if station_id in names:
+            names[station_id].add(base_name(synonym))
+    radius = max(settings.TRANSFER_RADIUS, settings.TRANSFER_SAME_NAME_RADIUS)
+    for row, (x, y) in zip(rows, grid.points):
+        station_id = row['station_id']
+        for d, other in grid.nearby(x, y, radius):
+            other_id = other['station_id']
+            if other_id == station_id:
+                continue
+            same_name = not names[station_id].isdisjoint(names[other_id])
+            if d <= settings.TRANSFER_RADIUS or (same_name and d <= settings.TRANSFER_SAME_NAME_RADIUS):
+                yield (station_id, other_id, round(d),
+                       max(1, math.ceil(d * settings.TRANSFER_DETOUR / settings.WALKING_SPEED)), same_name)
+
+
+station_grid = DatasetIndex(StationGrid.load)
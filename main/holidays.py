@@ -0,0 +1,109 @@
+"""Korean public-holiday calendar used to pick a day's holiday_type.
+
+Schedules distinguish weekdays ('1'), Saturdays ('2') and Sundays and
+public holidays ('3'). Fixed-date holidays are computed; the lunar
+holidays come from a table, so dates outside ``LUNAR_HOLIDAYS`` cannot be
+resolved. Substitute holidays follow the rules in force for each year.
+"""
+import datetime
+import functools
+
+WEEKDAY = '1'
+SATURDAY = '2'
+HOLIDAY = '3'
+
+# Gregorian dates of Seollal, Buddha's Birthday and Chuseok.
+LUNAR_HOLIDAYS = {
+    2020: ('2020-01-25', '2020-04-30', '2020-10-01'),
+    2021: ('2021-02-12', '2021-05-19', '2021-09-21'),
+    2022: ('2022-02-01', '2022-05-08', '2022-09-10'),
+    2023: ('2023-01-22', '2023-05-27', '2023-09-29'),
+    2024: ('2024-02-10', '2024-05-15', '2024-09-17'),
+    2025: ('2025-01-29', '2025-05-05', '2025-10-06'),
+    2026: ('2026-02-17', '2026-05-24', '2026-09-25'),
+    2027: ('2027-02-07', '2027-05-13', '2027-09-15'),
+    2028: ('2028-01-27', '2028-05-02', '2028-10-03'),
+    2029: ('2029-02-13', '2029-05-20', '2029-09-22'),
+    2030: ('2030-02-03', '2030-05-09', '2030-09-12'),
+}
+
+# (month, day, first year with a substitute holiday or None)
+FIXED_HOLIDAYS = (
+    (1, 1, None),     # New Year's Day
+    (3, 1, 2021),     # Independence Movement Day
+    (5, 5, 2014),     # Children's Day
+    (6, 6, None),     # Memorial Day
+    (8, 15, 2021),    # Liberation Day
+    (10, 3, 2021),    # National Foundation Day
+    (10, 9, 2021),    # Hangul Day
+    (12, 25, 2023),   # Christmas
+)
+
+BUDDHAS_BIRTHDAY_SUBSTITUTE_SINCE = 2023
+SEOLLAL_CHUSEOK_SUBSTITUTE_SINCE = 2014
+
+# Election days and one-off holidays declared by the government.
+TEMPORARY_HOLIDAYS = (
+    '2020-04-15', '2020-08-17', '2022-03-09', '2022-06-01', '2023-10-02',
+    '2024-04-10', '2024-10-01', '2025-01-27', '2025-06-03', '2026-06-03',
+    '2028-04-12',
+)
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+@functools.lru_cache(maxsize=None)
+def holidays(year):
+    """The public holidays of ``year``, substitute holidays included."""
+    if year not in LUNAR_HOLIDAYS:
+        raise ValueError('No lunar holiday table for {}'.format(year))
+    seollal, buddhas_birthday, chuseok = map(parse_date, LUNAR_HOLIDAYS[year])
+    one_day = datetime.timedelta(days=1)
+
+    # (dates, substitutable, Saturdays count as lost) of each holiday
+    observances = []
+    for month, day, since in FIXED_HOLIDAYS:
+        observances.append(([datetime.date(year, month, day)],
+                            since is not None and year >= since, True))
+    observances.append(([buddhas_birthday],
+                        year >= BUDDHAS_BIRTHDAY_SUBSTITUTE_SINCE, True))
+    for date in (seollal, chuseok):
+        observances.append(([date - one_day, date, date + one_day],
+                            year >= SEOLLAL_CHUSEOK_SUBSTITUTE_SINCE, False))
+
+    days = {}
+    for observance in observances:
+        for date in observance[0]:
+            days.setdefault(date, []).append(observance)
+    result = set(days)
+    result.update(date for date in map(parse_date, TEMPORARY_HOLIDAYS)
+                  if date.year == year)
+
+    # A substitutable holiday that falls on a Sunday (or a Saturday, for
+    # the single-day ones) or on another holiday gives back each day lost,
+    # on the first following working day.
+    for date in sorted(days):
+        substitutable = [observance for observance in days[date] if observance[1]]
+        if not substitutable:
+            continue
+        weekend = date.weekday() == 6 or (
+            date.weekday() == 5 and any(observance[2] for observance in substitutable))
+        lost = len(days[date]) - (0 if weekend else 1)
+        substitute = max(observance[0][-1] for observance in substitutable)
+        for _ in range(lost):
+            substitute += one_day
+            while substitute.weekday() >= 5 or substitute in result:
+                substitute += one_day
+            result.add(substitute)
+    return frozenset(result)
+
+
+def holiday_type(date):
+    """The holiday_type whose schedule runs on ``date``."""
+    if date.weekday() == 6 or date in holidays(date.year):
+        return HOLIDAY
+    if date.weekday() == 5:
+        return SATURDAY
+    return WEEKDAY
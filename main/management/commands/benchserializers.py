@@ -0,0 +1,74 @@
+import sys
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+
+from main.models import Departure, StationRoute
+from main.serializers import DepartureSerializer, StationRouteSerializer
+
+
+class ModelStationRouteSerializer(serializers.HyperlinkedModelSerializer):
+    route_id = serializers.CharField(source='route.route_id')
+    station_id = serializers.CharField(source='station.station_id')
+
+    class Meta:
+        model = StationRoute
+        fields = ('route_id', 'station_id',
+                  'station_order', 'up_down_direction')
+
+
+class ModelDepartureSerializer(serializers.HyperlinkedModelSerializer):
+    class Meta:
+        model = Departure
+        fields = ('holiday_type', 'route_id', 'station_id',
+                  'up_down_direction', 'time')
+
+
+def measure(func):
+    with CaptureQueriesContext(connection) as queries:
+        started = perf_counter()
+        data = func()
+        elapsed = perf_counter() - started
+    return data, elapsed, len(queries)
+
+
+class Command(BaseCommand):
+
+    help = 'Compares the values() serializers with DRF model serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            dest='rows',
+            default=1000,
+            help='Number of rows to serialize per run.',
+        )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        cases = [
+            ('station routes', StationRoute.objects.order_by('station_order', 'id'),
+             ModelStationRouteSerializer, StationRouteSerializer),
+            ('departures', Departure.objects.order_by('time', 'id'),
+             ModelDepartureSerializer, DepartureSerializer),
+        ]
+        for name, queryset, model_serializer, values_serializer in cases:
+            expected, model_elapsed, model_queries = measure(lambda: model_serializer(
+                queryset[:rows], many=True).data)
+            data, values_elapsed, values_queries = measure(lambda: values_serializer(
+                values_serializer.values(queryset)[:rows], many=True).data)
+            if [dict(row) for row in expected] != data:
+                sys.stdout.write(self.style.ERROR(
+                    '{}: outputs differ\n'.format(name)))
+                continue
+            count = max(len(data), 1)
+            sys.stdout.write('{}: {} rows\n'.format(name, len(data)))
+            sys.stdout.write('  model serializer:  {:8.2f} us/row, {} queries\n'.format(
+                model_elapsed / count * 1e6, model_queries))
+            sys.stdout.write('  values serializer: {:8.2f} us/row, {} queries ({:.1f}x)\n'.format(
+                values_elapsed / count * 1e6, values_queries,
+                model_elapsed / values_elapsed if values_elapsed else 0))
@@ -0,0 +1,203 @@
+import bisect
+import csv
+import datetime
+import io
+import sys
+import zipfile
+from contextlib import contextmanager
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import holidays
+from main.models import Departure, Route, Station
+from main.timetable import to_seconds
+
+# holiday_type -> GTFS service_id and the weekdays it runs on, Monday first.
+SERVICES = {
+    holidays.WEEKDAY: ('weekday', (1, 1, 1, 1, 1, 0, 0)),
+    holidays.SATURDAY: ('saturday', (0, 0, 0, 0, 0, 1, 0)),
+    holidays.HOLIDAY: ('holiday', (0, 0, 0, 0, 0, 0, 1)),
+}
+
+ADDED = 1
+REMOVED = 2
+
+AGENCY_ID = 'jejubus'
+
+BUS = 3
+
+
+@contextmanager
+def csv_writer(archive, name, header):
+    with archive.open(name, 'w') as f, io.TextIOWrapper(f, encoding='utf-8', newline='') as text:
+        writer = csv.writer(text)
+        writer.writerow(header)
+        yield writer
+
+
+def get_direction_id(up_down_direction):
+    return up_down_direction if up_down_direction in ('0', '1') else ''
+
+
+def calendar_exceptions(start_date, end_date):
+    """The calendar_dates.txt rows that make every date from ``start_date``
+    to ``end_date`` run the service of its holiday_type, and the years the
+    holiday calendar does not cover."""
+    rows = []
+    uncovered = set()
+    date = start_date
+    while date <= end_date:
+        try:
+            holiday_type = holidays.holiday_type(date)
+        except ValueError:
+            uncovered.add(date.year)
+        else:
+            scheduled = next(key for key, (_, days) in SERVICES.items() if days[date.weekday()])
+            if holiday_type != scheduled:
+                rows.append((SERVICES[scheduled][0], date.strftime('%Y%m%d'), REMOVED))
+                rows.append((SERVICES[holiday_type][0], date.strftime('%Y%m%d'), ADDED))
+        date += datetime.timedelta(days=1)
+    return rows, sorted(uncovered)
+
+
+def stop_times(times):
+    """GTFS arrival/departure times of a trip's stops. A time earlier than
+    the one before it is on the next service day, so a trip past midnight
+    goes on counting from 24:00:00."""
+    day = 0
+    previous = None
+    for time in times:
+        seconds = to_seconds(time) + day
+        if previous is not None and seconds < previous:
+            day += 86400
+            seconds += 86400
+        previous = seconds
+        yield '%02d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def chain_trips(stops):
+    """Chain the departures of one route, direction and service into trips.
+
+    ``stops`` is a list of (station_order, station_id, sorted times). Each
+    departure joins the unfinished trip whose previous departure is the
+    latest one not after it, or starts a new trip, so trips never go back
+    in time and may skip stops.
+    """
+    trips = []
+    last_times = []  # sorted (time, trip) of each trip's latest departure
+    for station_order, station_id, times in stops:
+        assigned = []
+        for time in times:
+            i = bisect.bisect_right(last_times, (time, len(trips))) - 1
+            if i >= 0:
+                trip = last_times.pop(i)[1]
+            else:
+                trip = len(trips)
+                trips.append([])
+            trips[trip].append((station_order, station_id, time))
+            assigned.append((time, trip))
+        last_times = sorted(last_times + assigned)
+    return trips
+
+
+class Command(BaseCommand):
+
+    help = 'Exports the loaded timetable as a GTFS static feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='gtfs.zip',
+            help='Path of the zip file to write.',
+        )
+        parser.add_argument(
+            '--start-date',
+            dest='start_date',
+            default=None,
+            help='First service date as YYYYMMDD. Defaults to today.',
+        )
+        parser.add_argument(
+            '--end-date',
+            dest='end_date',
+            default=None,
+            help='Last service date as YYYYMMDD. Defaults to a year after the start date.',
+        )
+
+    def handle(self, *args, **options):
+        start_date = options['start_date'] or timezone.localdate().strftime('%Y%m%d')
+        end_date = options['end_date'] or (datetime.datetime.strptime(
+            start_date, '%Y%m%d').date() + datetime.timedelta(days=365)).strftime('%Y%m%d')
+
+        with zipfile.ZipFile(options['path'], 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with csv_writer(archive, 'agency.txt', ('agency_id', 'agency_name', 'agency_url', 'agency_timezone')) as writer:
+                writer.writerow(
+                    (AGENCY_ID, '제주버스', 'http://bus.jeju.go.kr', 'Asia/Seoul'))
+
+            with csv_writer(archive, 'stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon')) as writer:
+                for station_id, station_name, local_x, local_y in Station.objects.values_list(
+                        'station_id', 'station_name', 'local_x', 'local_y').order_by('station_id').iterator():
+                    writer.writerow((station_id, station_name, local_y, local_x))
+
+            with csv_writer(archive, 'routes.txt', ('route_id', 'agency_id', 'route_short_name', 'route_type')) as writer:
+                for route_id, route_number in Route.objects.values_list(
+                        'route_id', 'route_number').order_by('route_id').iterator():
+                    writer.writerow((route_id, AGENCY_ID, route_number, BUS))
+
+            with csv_writer(archive, 'calendar.txt', ('service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday', 'start_date', 'end_date')) as writer:
+                for service_id, days in SERVICES.values():
+                    writer.writerow((service_id,) + days +
+                                    (start_date, end_date))
+
+            # Public holidays on weekdays and Saturdays run the holiday service.
+            exceptions, uncovered = calendar_exceptions(datetime.datetime.strptime(start_date, '%Y%m%d').date(),
+                                                        datetime.datetime.strptime(end_date, '%Y%m%d').date())
+            with csv_writer(archive, 'calendar_dates.txt', ('service_id', 'date', 'exception_type')) as writer:
+                writer.writerows(exceptions)
+            if uncovered:
+                sys.stderr.write('The holiday calendar does not cover {}; those dates follow the weekly '
+                                 'calendar only.\n'.format(', '.join(map(str, uncovered))))
+
+            # Only one archive member can be open for writing at a time, so
+            # the (small) trips table is written after the stop times.
+            trips = []
+            with csv_writer(archive, 'stop_times.txt', ('trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence')) as writer:
+                rows = Departure.objects.filter(holiday_type__in=SERVICES, trip_id__isnull=False).values_list(
+                    'trip_id', 'route_id', 'up_down_direction', 'holiday_type', 'station_order', 'station_id', 'time').order_by(
+                    'trip_id', 'station_order', 'time').iterator()
+                for trip_id, group in groupby(rows, lambda row: row[0]):
+                    stops = list(group)
+                    route_id, up_down_direction, holiday_type = stops[0][1:4]
+                    trips.append((route_id, SERVICES[holiday_type][0], trip_id,
+                                  get_direction_id(up_down_direction)))
+                    for (station_order, station_id, _), time in zip(
+                            (row[4:] for row in stops), stop_times(row[6] for row in stops)):
+                        writer.writerow(
+                            (trip_id, time, time, station_id, station_order))
+
+                # Departures loaded before trips were recorded are chained
+                # into trips heuristically.
+                rows = Departure.objects.filter(holiday_type__in=SERVICES, trip_id__isnull=True).values_list(
+                    'route_id', 'up_down_direction', 'holiday_type', 'station_order', 'station_id', 'time').order_by(
+                    'route_id', 'up_down_direction', 'holiday_type', 'station_order', 'time').iterator()
+                for (route_id, up_down_direction, holiday_type), group in groupby(rows, lambda row: row[:3]):
+                    stops = [(station_order, station_id, [row[5] for row in stop])
+                             for (station_order, station_id), stop in groupby(group, lambda row: row[3:5])]
+                    service_id = SERVICES[holiday_type][0]
+                    for i, trip in enumerate(chain_trips(stops)):
+                        trip_id = '{}_{}_{}_{}'.format(
+                            route_id, up_down_direction, service_id, i)
+                        trips.append(
+                            (route_id, service_id, trip_id, get_direction_id(up_down_direction)))
+                        for (station_order, station_id, _), time in zip(
+                                trip, stop_times(time for _, _, time in trip)):
+                            writer.writerow(
+                                (trip_id, time, time, station_id, station_order))
+
+            with csv_writer(archive, 'trips.txt', ('route_id', 'service_id', 'trip_id', 'direction_id')) as writer:
+                writer.writerows(trips)
+
+        sys.stdout.write(self.style.SUCCESS(
+            'Exported {} trips to {}\n'.format(len(trips), options['path'])))
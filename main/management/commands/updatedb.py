@@ -5,39 +5,67 @@ import re
 import shutil
 import sys
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import namedtuple
 from contextlib import contextmanager
+from itertools import count, islice
+from time import perf_counter
 import inquirer
 import requests
 import xmltodict
 from openpyxl import load_workbook
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
-from django.db.models import Func, F
-
-from main.models import Route, Station, StationSynonym, StationRoute, Time
-
-
-def download(url: str, dest_folder: str):
-    if not os.path.exists(dest_folder):
-        os.makedirs(dest_folder)  # create folder if it does not exist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from main import dataset
+from main.search import StationSearch
+from main.snapshot import write_snapshot
+from main.staging import StagingError, rollback, row_counts, staged_database, validate
+from main.summary import summarize
+from main.geo import walking_transfers
+from main.models import (Departure, Route, RouteHeadway, RouteSegment, RouteSummary, Station, StationSynonym,
+                         StationRoute, Time, Transfer, Trip)
+
+
+def create_session():
+    """Return a keep-alive session that retries failed requests with
+    exponential backoff."""
+    retry = Retry(total=settings.DOWNLOAD_RETRIES,
+                  backoff_factor=settings.DOWNLOAD_BACKOFF,
+                  status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_maxsize=settings.DOWNLOAD_CONCURRENCY,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download(session: requests.Session, url: str, dest_folder: str):
+    os.makedirs(dest_folder, exist_ok=True)  # create folder if it does not exist
 
     filename = url.split('/')[-1].replace(
         " ", "_") + ".xlsx"  # be careful with file names
     file_path = os.path.join(dest_folder, filename)
 
-    r = requests.get(url, stream=True)
-    if r.ok:
-        print("saving to", os.path.abspath(file_path))
-        with open(file_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024 * 8):
-                if chunk:
+    with session.get(url, stream=True, timeout=settings.DOWNLOAD_TIMEOUT) as r:
+        if r.ok:
+            with open(file_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=1024 * 64):
                     f.write(chunk)
-                    f.flush()
-                    os.fsync(f.fileno())
-    else:  # HTTP status code 4XX/5XX
-        print("Download failed: status code {}\n{}".format(r.status_code, r.text))
+                f.flush()
+                os.fsync(f.fileno())
+            return file_path
+        else:  # HTTP status code 4XX/5XX
+            tqdm.write("Download failed: {} status code {}\n{}".format(
+                url, r.status_code, r.text))
+            return None
 
 
 def extract_holiday_types_from_string(s):
@@ -87,144 +115,392 @@ def extract_time_from_string(s):
         return datetime.time(int(matches[0][0]), int(matches[0][1]), 0)
 
 
-def get_all_routes():
-    url = 'http://busopen.jeju.go.kr/OpenAPI/service/bis/Bus'
-
-    r = requests.get(url)
+def get_items(session: requests.Session, name: str):
+    r = session.get(settings.BUS_OPEN_API_URL + name,
+                    timeout=settings.DOWNLOAD_TIMEOUT)
+    r.raise_for_status()
     data = xmltodict.parse(r.content)
 
     return data['response']['body']['items']['item']
 
 
-def get_all_station_routes():
-    url = 'http://busopen.jeju.go.kr/OpenAPI/service/bis/StationRoute'
+def get_all_routes(session: requests.Session):
+    return get_items(session, 'Bus')
 
-    r = requests.get(url)
-    data = xmltodict.parse(r.content)
 
-    return data['response']['body']['items']['item']
+def get_all_station_routes(session: requests.Session):
+    return get_items(session, 'StationRoute')
 
 
-def get_all_stations():
-    url = 'http://busopen.jeju.go.kr/OpenAPI/service/bis/Station'
+def get_all_stations(session: requests.Session):
+    return get_items(session, 'Station')
 
-    r = requests.get(url)
-    data = xmltodict.parse(r.content)
 
-    return data['response']['body']['items']['item']
+def fetch_all(dest_folder: str):
+    """Download the schedule workbooks and the Open API feeds concurrently.
 
+    Returns the routes, stations and station routes from the Open API.
+    """
+    # The progress bar is created before any worker starts: tqdm sets up its
+    # write lock lazily, and doing that while a worker is inside tqdm.write
+    # deadlocks.
+    progress = tqdm(total=len(settings.ROUTE_TYPES) + 3, desc="Downloading")
+    with progress, create_session() as session, ThreadPoolExecutor(max_workers=settings.DOWNLOAD_CONCURRENCY) as executor:
+        downloads = [executor.submit(download, session, settings.BUS_SCHEDULE_URL + route_type, dest_folder)
+                     for route_type in settings.ROUTE_TYPES]
+        routes = executor.submit(get_all_routes, session)
+        stations = executor.submit(get_all_stations, session)
+        station_routes = executor.submit(get_all_station_routes, session)
+        for future in as_completed(downloads + [routes, stations, station_routes]):
+            future.result()
+            progress.update()
+        return routes.result(), stations.result(), station_routes.result()
 
-def get_first_cell(worksheet):
-    for row_cells in worksheet.iter_rows():
-        for cell in row_cells:
-            if cell.value is not None:
-                return cell
-
-
-def get_node_ids(node_name):
-    return [x.station_id for x in Station.objects.filter(station_name__icontains=node_name)]
-
-
-def get_route_node(route_id, node_name, start=None, end=None, interactive=True):
-    sl = slice(start, end)
-    station_routes = list(StationRoute.objects.filter(
-        route__route_id=route_id).order_by('station_order'))[sl]
-    node_ids = get_node_ids(node_name)
-    for station_route in station_routes:
-        for node_id in node_ids:
-            if station_route.station.station_id == node_id:
-                return station_route
-    station_synonyms = StationSynonym.objects.filter(synonym=node_name)
-    if station_synonyms.exists():
-        for station_route in station_routes:
-            for o in station_synonyms:
-                if station_route.station.station_id == o.station_id:
-                    return station_route
-    if interactive:
-        choices = [(station_route.station.station_name, i)
-                   for i, station_route in enumerate(station_routes)]
-        if choices:
-            choices.sort(key=lambda x: difflib.SequenceMatcher(
-                None, x[0], node_name).ratio(), reverse=True)
-            questions = [
-                inquirer.List(
-                    'node_name',
-                    message="What node is " + node_name + "?",
-                    choices=choices, ),
-            ]
-            answers = inquirer.prompt(questions)
-            if answers is None:
-                return None
-            else:
-                selected_node = station_routes[answers["node_name"]]
-                station_synonym = StationSynonym(
-                    station_id=selected_node.station.station_id, synonym=node_name)
-                station_synonym.save()
-                return selected_node
-        else:
-            return None
-    else:
-        return None
 
+def get_sheet_names(path):
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+
+def parse_sheet(path, sheet_name):
+    """Read a schedule sheet in streaming mode into a plain record.
+
+    The record holds the route number and holiday types from the title cell,
+    the node names of the header row five rows below it and, for every
+    timetable row, its route number (None when the row has none) and one
+    time per node.
+    """
+    wb = load_workbook(filename=path, read_only=True, data_only=True)
+    try:
+        sheet = wb[sheet_name]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+
+        title = None
+        for title_row in rows:
+            title = next((value for value in title_row if value is not None), None)
+            if title is not None:
+                break
+        if title is None:
+            return None
+        header = next(islice(rows, 4, None), ())
+        # Timetable values start two rows below the header.
+        next(rows, None)
+
+        node_names = []
+        node_columns = []
+        route_number_column = None
+        for column, node_name in enumerate(header):
+            if node_name is not None:
+                node_name = "".join(str(node_name).split())
+                if node_name == "노선번호":
+                    route_number_column = column
+                elif node_name != "구분" and node_name != "비고":
+                    node_names.append(extract_node_name_from_string(node_name))
+                    node_columns.append(column)
+
+        time_rows = []
+        for values in rows:
+            times = []
+            for column in node_columns:
+                time = values[column] if column < len(values) else None
+                if isinstance(time, str):
+                    time = extract_time_from_string(time)
+                elif type(time) is not datetime.time:
+                    time = None
+                times.append(time)
+            if any(time is not None for time in times):
+                route_number = None
+                if route_number_column is not None and route_number_column < len(values) and \
+                        values[route_number_column] is not None:
+                    route_number = extract_route_number_from_string(
+                        str(values[route_number_column]))
+                time_rows.append((route_number, times))
+
+        return {
+            'path': path,
+            'sheet': sheet_name,
+            'route_number': extract_route_number_from_string(str(title)),
+            'holiday_types': extract_holiday_types_from_string(str(title)),
+            'node_names': node_names,
+            'has_route_numbers': route_number_column is not None,
+            'rows': time_rows,
+        }
+    finally:
+        wb.close()
+
+
+def parse_workbooks(paths, jobs=None):
+    """Parse every sheet of every workbook across a process pool."""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        sheets = [(path, sheet_name)
+                  for path, sheet_names in zip(paths, executor.map(get_sheet_names, paths))
+                  for sheet_name in sheet_names]
+        futures = [executor.submit(parse_sheet, path, sheet_name)
+                   for path, sheet_name in sheets]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Parsing sheets"):
+            future.result()
+        return [record for record in (future.result() for future in futures)
+                if record is not None]
+
+
+def load_sheet(record, resolver, trip_ids, interactive=True):
+    """Resolve a parsed sheet and build its Trip and Time rows.
+
+    Every timetable row is one bus run, so each row becomes one trip per
+    holiday type, numbered from ``trip_ids``.
+    """
+    node_names = record['node_names']
+    route = resolver.route(record['route_number'], node_names, interactive)
+    if route is None:
+        return [], []
 
-def get_route_nodes(route_id, node_names):
     route_nodes = []
     last = None
-    for i, node_name in enumerate(node_names):
+    i = 0
+    for index, node_name in enumerate(node_names):
         if last is None:
-            route_node = get_route_node(route_id, node_name, 0, 1, False)
+            route_node = resolver.route_node(
+                route.route_id, node_name, 0, 1, interactive)
         else:
-            route_node = get_route_node(
-                route_id, node_name, last, -(len(node_names) - i - 1) or None, False)
+            route_node = resolver.route_node(
+                route.route_id, node_name, last, -(len(node_names) - i - 1) or None, interactive)
         if route_node is None:
             continue
-        route_nodes.append(route_node)
         last = route_node.station_order
-    return route_nodes
-
-
-def get_route(route_number, node_names, interactive=True):
-    routes = Route.objects.filter(route_number__icontains=route_number)
-    if routes:
-        route_nodes_list = [get_route_nodes(
-            route.route_id, node_names) for route in routes]
-        choices = [("-".join([x.station.station_name for x in route_nodes]), i)
-                   for i, route_nodes in enumerate(route_nodes_list)]
-        if choices:
-            choices.sort(key=lambda x: len(
-                route_nodes_list[x[1]]), reverse=True)
-            if interactive:
+        i += 1
+        route_nodes.append((index, route_node))
+
+    trip_objs = []
+    time_objs = []
+    for route_number, times in record['rows']:
+        # Rows without a route number of their own run the sheet's route.
+        row_route = route
+        if record['has_route_numbers'] and route_number:
+            row_route = resolver.route(route_number, node_names, interactive)
+            if row_route is None:
+                continue
+        stops = []
+        for index, route_node in route_nodes:
+            time = times[index]
+            if time is None:
+                continue
+            station_route = resolver.nearest_station_route(
+                row_route.route_id, route_node)
+            if station_route:
+                stops.append((station_route, time))
+        if not stops:
+            continue
+        for holiday_type in record['holiday_types']:
+            trip = Trip(id=next(trip_ids), route_id=row_route.route_id, holiday_type=holiday_type,
+                        up_down_direction=stops[0][0].up_down_direction)
+            trip_objs.append(trip)
+            for station_route, time in stops:
+                time_objs.append(Time(
+                    holiday_type=holiday_type, station_route_id=station_route.id, time=time, trip_id=trip.id))
+    return trip_objs, time_objs
+
+
+RouteNode = namedtuple(
+    'RouteNode', ('id', 'route_id', 'station_id', 'station_order', 'up_down_direction'))
+
+
+class Resolver:
+    """Resolves schedule node names and route numbers against an in-memory
+    copy of the stations, synonyms and station routes.
+
+    It is built once per run; every lookup that used to be a query is a
+    dictionary lookup or a memoized scan.
+    """
+
+    def __init__(self):
+        self.station_names = dict(
+            Station.objects.values_list('station_id', 'station_name'))
+        self.routes = list(Route.objects.order_by('route_id'))
+        self.synonyms = {}
+        for station_id, synonym in StationSynonym.objects.values_list('station_id', 'synonym'):
+            self.synonyms.setdefault(synonym, []).append(station_id)
+        self.route_stations = {}
+        for row in StationRoute.objects.values_list(
+                'id', 'route_id', 'station_id', 'station_order', 'up_down_direction').order_by('station_order', 'id'):
+            route_node = RouteNode(*row)
+            self.route_stations.setdefault(
+                route_node.route_id, []).append(route_node)
+        self.station_search = StationSearch([
+            {'station_id': station_id, 'station_name': station_name}
+            for station_id, station_name in self.station_names.items()])
+        self._node_ids = {}
+        self._routes_by_number = {}
+        self._resolved_routes = {}
+
+    def node_ids(self, node_name):
+        """Station ids whose name contains ``node_name``."""
+        if node_name not in self._node_ids:
+            self._node_ids[node_name] = self.station_search.contains(node_name)
+        return self._node_ids[node_name]
+
+    def add_synonym(self, station_id, synonym):
+        StationSynonym.objects.create(station_id=station_id, synonym=synonym)
+        self.synonyms.setdefault(synonym, []).append(station_id)
+
+    def route_node(self, route_id, node_name, start=None, end=None, interactive=True):
+        route_nodes = self.route_stations.get(route_id, [])[start:end]
+        node_ids = self.node_ids(node_name)
+        for route_node in route_nodes:
+            if route_node.station_id in node_ids:
+                return route_node
+        synonym_ids = self.synonyms.get(node_name, ())
+        for route_node in route_nodes:
+            if route_node.station_id in synonym_ids:
+                return route_node
+        if interactive:
+            choices = [(self.station_names[route_node.station_id], i)
+                       for i, route_node in enumerate(route_nodes)]
+            if choices:
+                choices.sort(key=lambda x: difflib.SequenceMatcher(
+                    None, x[0], node_name).ratio(), reverse=True)
                 questions = [
                     inquirer.List(
-                        'route',
-                        message="What route is " + route_number +
-                        " " + "-".join(node_names) + "?",
+                        'node_name',
+                        message="What node is " + node_name + "?",
                         choices=choices, ),
                 ]
                 answers = inquirer.prompt(questions)
                 if answers is None:
                     return None
                 else:
-                    selected_route = routes[answers["route"]]
+                    selected_node = route_nodes[answers["node_name"]]
+                    self.add_synonym(selected_node.station_id, node_name)
+                    return selected_node
             else:
-                selected_route = routes[choices[0][1]]
-            station_routes = StationRoute.objects.filter(
-                route__route_id=selected_route.route_id).order_by('station_order')
-            start_station = station_routes.first().station
-            end_station = station_routes.last().station
-            if start_station.station_name != node_names[0] and not StationSynonym.objects.filter(synonym=node_names[0]).exists():
-                start_station_synonym = StationSynonym(
-                    station_id=start_station.station_id, synonym=node_names[0])
-                start_station_synonym.save()
-            if end_station.station_name != node_names[-1] and not StationSynonym.objects.filter(synonym=node_names[-1]).exists():
-                end_station_synonym = StationSynonym(
-                    station_id=end_station.station_id, synonym=node_names[-1])
-                end_station_synonym.save()
-            return selected_route
+                return None
         else:
             return None
-    else:
-        return None
+
+    def route_nodes(self, route_id, node_names):
+        route_nodes = []
+        last = None
+        for i, node_name in enumerate(node_names):
+            if last is None:
+                route_node = self.route_node(
+                    route_id, node_name, 0, 1, False)
+            else:
+                route_node = self.route_node(
+                    route_id, node_name, last, -(len(node_names) - i - 1) or None, False)
+            if route_node is None:
+                continue
+            route_nodes.append(route_node)
+            last = route_node.station_order
+        return route_nodes
+
+    def routes_by_number(self, route_number):
+        """Routes whose number contains ``route_number``."""
+        if route_number not in self._routes_by_number:
+            needle = route_number.lower()
+            self._routes_by_number[route_number] = [
+                route for route in self.routes if needle in route.route_number.lower()]
+        return self._routes_by_number[route_number]
+
+    def route(self, route_number, node_names, interactive=True):
+        key = (route_number, tuple(node_names))
+        if key not in self._resolved_routes:
+            self._resolved_routes[key] = self._route(
+                route_number, node_names, interactive)
+        return self._resolved_routes[key]
+
+    def _route(self, route_number, node_names, interactive):
+        routes = self.routes_by_number(route_number)
+        if routes:
+            route_nodes_list = [self.route_nodes(
+                route.route_id, node_names) for route in routes]
+            choices = [("-".join([self.station_names[x.station_id] for x in route_nodes]), i)
+                       for i, route_nodes in enumerate(route_nodes_list)]
+            if choices:
+                choices.sort(key=lambda x: len(
+                    route_nodes_list[x[1]]), reverse=True)
+                if interactive:
+                    questions = [
+                        inquirer.List(
+                            'route',
+                            message="What route is " + route_number +
+                            " " + "-".join(node_names) + "?",
+                            choices=choices, ),
+                    ]
+                    answers = inquirer.prompt(questions)
+                    if answers is None:
+                        return None
+                    else:
+                        selected_route = routes[answers["route"]]
+                else:
+                    selected_route = routes[choices[0][1]]
+                route_nodes = self.route_stations.get(
+                    selected_route.route_id)
+                if route_nodes:
+                    start_station_id = route_nodes[0].station_id
+                    end_station_id = route_nodes[-1].station_id
+                    if self.station_names[start_station_id] != node_names[0] and node_names[0] not in self.synonyms:
+                        self.add_synonym(start_station_id, node_names[0])
+                    if self.station_names[end_station_id] != node_names[-1] and node_names[-1] not in self.synonyms:
+                        self.add_synonym(end_station_id, node_names[-1])
+                return selected_route
+            else:
+                return None
+        else:
+            return None
+
+    def nearest_station_route(self, route_id, route_node):
+        """The stop of ``route_id`` at ``route_node``'s station whose relative
+        position along the route is closest to ``route_node``'s."""
+        route_nodes = self.route_stations.get(route_id, [])
+        candidates = [x for x in route_nodes
+                      if x.station_id == route_node.station_id]
+        if not candidates:
+            return None
+        position = (route_node.station_order - 1) / \
+            max(len(self.route_stations[route_node.route_id]) - 1, 1)
+        return min(candidates, key=lambda x: abs(
+            (x.station_order - 1) / max(len(route_nodes) - 1, 1) - position))
+
+
+def bulk_insert(model, objs, chunk_size=None):
+    chunk_size = chunk_size or settings.BULK_CHUNK_SIZE
+    objs = iter(objs)
+    count = 0
+    while True:
+        chunk = list(islice(objs, chunk_size))
+        if not chunk:
+            return count
+        model.objects.bulk_create(chunk)
+        count += len(chunk)
+
+
+def bulk_upsert(model, objs, fields):
+    objs = {obj.pk: obj for obj in objs}
+    existing = set(model.objects.filter(
+        pk__in=list(objs)).values_list('pk', flat=True))
+    count = bulk_insert(model, (obj for pk, obj in objs.items()
+                                if pk not in existing))
+    updated = [obj for pk, obj in objs.items() if pk in existing]
+    if updated:
+        model.objects.bulk_update(
+            updated, fields, batch_size=settings.BULK_CHUNK_SIZE)
+    return count + len(updated)
+
+
+@contextmanager
+def phase(description):
+    sys.stdout.write(description + ' ... ')
+    sys.stdout.flush()
+    stats = {'rows': 0}
+    started = perf_counter()
+    with transaction.atomic():
+        yield stats
+    elapsed = perf_counter() - started
+    sys.stdout.write('done. ({} rows in {:.2f}s, {:.0f} rows/s)\n'.format(
+        stats['rows'], elapsed, stats['rows'] / elapsed if elapsed else 0))
 
 
 @contextmanager
@@ -263,8 +539,48 @@ class Command(BaseCommand):
             default=True,
             help='Do NOT prompt the user for input of any kind.',
         )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            dest='jobs',
+            default=None,
+            help='Number of worker processes used to parse the schedules. '
+                 'Defaults to the number of CPUs.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            help='Publish the new dataset even if it has far fewer rows than the current one',
+        )
+        parser.add_argument(
+            '--rollback',
+            action='store_true',
+            dest='rollback',
+            help='Swap the current dataset with the one the last update replaced',
+        )
 
     def handle(self, *args, **options):
+        if options['rollback']:
+            try:
+                rollback()
+            except StagingError as e:
+                raise CommandError(e)
+            sys.stdout.write(self.style.SUCCESS(
+                'Successfully rolled back the database\n'))
+            return
+
+        live_counts = row_counts()
+        try:
+            with staged_database() as snapshot_path:
+                self.update(live_counts, snapshot_path, options)
+        except StagingError as e:
+            raise CommandError(e)
+
+        sys.stdout.write(self.style.SUCCESS(
+            'Successfully updated the database\n'))
+
+    def update(self, live_counts, snapshot_path, options):
         if options['clear_synonyms']:
             sys.stdout.write('Clearing station synonyms ... ')
             sys.stdout.flush()
@@ -272,139 +588,92 @@ class Command(BaseCommand):
             sys.stdout.write('done.\n')
 
         if options['clear_db']:
-            sys.stdout.write('Clearing database ... ')
-            sys.stdout.flush()
-            Time.objects.all().delete()
-            StationRoute.objects.all().delete()
-            Route.objects.all().delete()
-            Station.objects.all().delete()
-            sys.stdout.write('done.\n')
+            with phase('Clearing database') as stats:
+                for model in (Departure, RouteSummary, RouteHeadway, RouteSegment, Transfer, Time, Trip,
+                              StationRoute, Route, Station):
+                    stats['rows'] += model.objects.all().delete()[0]
 
         with tempdir() as base_dir:
-            for route_type in settings.ROUTE_TYPES:
-                download(
-                    "http://bus.jeju.go.kr/publicTrafficInformation/downloadSchedule/" +
-                    route_type,
-                    dest_folder=base_dir)
+            routes, stations, station_routes = fetch_all(base_dir)
 
-            sys.stdout.write('Saving routes ... ')
-            sys.stdout.flush()
-            for route in get_all_routes():
-                route_obj = Route(
+            with phase('Saving routes') as stats:
+                stats['rows'] = bulk_upsert(Route, (Route(
                     route_type=route['routeTp'], route_id=route['routeId'], route_number=route['routeNum'])
-                route_obj.save()
-            sys.stdout.write('done.\n')
+                    for route in routes), ['route_type', 'route_number'])
 
-            sys.stdout.write('Saving stations ... ')
-            sys.stdout.flush()
-            for station in get_all_stations():
-                station_obj = Station(
+            with phase('Saving stations') as stats:
+                stats['rows'] = bulk_upsert(Station, (Station(
                     local_x=station['localX'], local_y=station['localY'], station_id=station['stationId'], station_name=station['stationNm'])
-                station_obj.save()
-            sys.stdout.write('done.\n')
-
-            sys.stdout.write('Saving station routes ... ')
-            sys.stdout.flush()
-            for station_route in get_all_station_routes():
-                route = Route.objects.get(route_id=station_route['routeId'])
-                station = Station.objects.get(
-                    station_id=station_route['stationId'])
-                station_route_obj = StationRoute(route=route, station=station, station_order=int(
-                    station_route['stationOrd']), up_down_direction=station_route['updnDir'])
-                station_route_obj.save()
-            sys.stdout.write('done.\n')
+                    for station in stations), ['local_x', 'local_y', 'station_name'])
+
+            with phase('Saving station routes') as stats:
+                route_ids = set(Route.objects.values_list('route_id', flat=True))
+                station_ids = set(
+                    Station.objects.values_list('station_id', flat=True))
+                stats['rows'] = bulk_insert(StationRoute, (StationRoute(
+                    route_id=station_route['routeId'], station_id=station_route['stationId'], station_order=int(
+                        station_route['stationOrd']), up_down_direction=station_route['updnDir'])
+                    for station_route in station_routes
+                    if station_route['routeId'] in route_ids and station_route['stationId'] in station_ids))
 
             with os.scandir(base_dir) as it:
-                items = (entry for entry in it if entry.name.endswith(
+                paths = sorted(entry.path for entry in it if entry.name.endswith(
                     ".xlsx") and entry.is_file())
-
-                pbar = tqdm(items, total=len(os.listdir(base_dir)))
-                for entry in pbar:
-                    pbar.set_description("Processing %s" % entry.name)
-
-                    wb = load_workbook(filename=entry.path, data_only=True)
-
-                    pbar2 = tqdm(wb.worksheets)
-                    for sheet in pbar2:
-                        first_cell = get_first_cell(sheet)
-
-                        route_number = first_cell.value
-                        holiday_types = extract_holiday_types_from_string(
-                            route_number)
-                        route_number = extract_route_number_from_string(
-                            route_number)
-
-                        node_names = []
-                        row = first_cell.offset(row=5).row
-                        for cell in sheet[row]:
-                            node_name = cell.value
-                            if node_name is not None:
-                                node_name = "".join(node_name.split())
-                                if node_name != "노선번호" and node_name != "구분" and node_name != "비고":
-                                    node_name = extract_node_name_from_string(
-                                        node_name)
-                                    node_names.append(node_name)
-
-                        route = get_route(
-                            route_number, node_names, options['interactive'])
-                        if route is None:
-                            continue
-
-                        pbar2.set_description(
-                            "Processing route %s" % route.route_number)
-
-                        route_number_column = None
-                        last = None
-                        i = 0
-                        for cell in sheet[row]:
-                            node_name = cell.value
-                            if node_name is not None:
-                                node_name = "".join(node_name.split())
-                                if node_name == "노선번호":
-                                    route_number_column = cell.column_letter
-                                elif node_name != "구분" and node_name != "비고":
-                                    node_name = extract_node_name_from_string(
-                                        node_name)
-                                    if last is None:
-                                        route_node = get_route_node(
-                                            route.route_id, node_name, 0, 1, options['interactive'])
-                                    else:
-                                        route_node = get_route_node(
-                                            route.route_id, node_name, last, -(len(node_names) - i - 1) or None, options['interactive'])
-                                    if route_node is None:
-                                        continue
-                                    last = route_node.station_order
-                                    i += 1
-                                    station = route_node.station
-                                    node_name = station.station_name
-                                    for cell2 in sheet[cell.column][cell.row + 1:]:
-                                        time = cell2.value
-                                        if time is not None:
-                                            if isinstance(time, str):
-                                                time = extract_time_from_string(
-                                                    time)
-                                                if time is None:
-                                                    continue
-                                            elif type(time) is not datetime.time:
-                                                continue
-                                            if route_number_column is not None:
-                                                cell_name = "{}{}".format(
-                                                    route_number_column, cell2.row)
-                                                route_number = sheet[cell_name].value
-                                                route_number = extract_route_number_from_string(
-                                                    str(route_number))
-
-                                                route = get_route(
-                                                    route_number, node_names, options['interactive'])
-                                                if route is None:
-                                                    continue
-                                            station_route = StationRoute.objects.filter(route=route, station=station).annotate(abs_diff=Func((F('station_order') - 1) / (StationRoute.objects.filter(
-                                                route=route).count() - 1) - (route_node.station_order - 1) / (StationRoute.objects.filter(route=route_node.route).count() - 1), function='ABS')).order_by('abs_diff').first()
-                                            if station_route:
-                                                for holiday_type in holiday_types:
-                                                    time_obj = Time(
-                                                        holiday_type=holiday_type, station_route=station_route, time=time)
-                                                    time_obj.save()
-
-        sys.stdout.write(self.style.SUCCESS(
-            'Successfully updated the database\n'))
+            records = parse_workbooks(paths, options['jobs'])
+
+            resolver = Resolver()
+            trip_ids = count((Trip.objects.aggregate(Max('id'))['id__max'] or 0) + 1)
+            trip_objs = []
+            time_objs = []
+            pbar = tqdm(records)
+            for record in pbar:
+                pbar.set_description("Processing %s %s" % (
+                    os.path.basename(record['path']), record['sheet']))
+                sheet_trips, sheet_times = load_sheet(
+                    record, resolver, trip_ids, options['interactive'])
+                trip_objs.extend(sheet_trips)
+                time_objs.extend(sheet_times)
+
+            with phase('Saving trips') as stats:
+                stats['rows'] = bulk_insert(Trip, trip_objs)
+
+            with phase('Saving times') as stats:
+                stats['rows'] = bulk_insert(Time, time_objs)
+
+            with phase('Saving departures') as stats:
+                Departure.objects.all().delete()
+                stats['rows'] = bulk_insert(Departure, (Departure(
+                    route_id=route_id, station_id=station_id, up_down_direction=up_down_direction,
+                    holiday_type=holiday_type, station_order=station_order, time=time, trip_id=trip_id)
+                    for route_id, station_id, up_down_direction, holiday_type, station_order, time, trip_id in Time.objects.values_list(
+                        'station_route__route_id', 'station_route__station_id', 'station_route__up_down_direction',
+                        'holiday_type', 'station_route__station_order', 'time', 'trip_id').iterator()))
+
+        with phase('Saving route summaries') as stats:
+            for model in (RouteSummary, RouteHeadway, RouteSegment):
+                model.objects.all().delete()
+            summaries, headways, segments = summarize(Departure.objects.filter(trip_id__isnull=False).values_list(
+                'trip_id', 'route_id', 'holiday_type', 'up_down_direction', 'station_order', 'station_id', 'time').order_by(
+                'trip_id', 'station_order', 'time').iterator())
+            stats['rows'] = bulk_insert(RouteSummary, (RouteSummary(**row) for row in summaries)) + \
+                bulk_insert(RouteHeadway, (RouteHeadway(**row) for row in headways)) + \
+                bulk_insert(RouteSegment, (RouteSegment(**row) for row in segments))
+
+        with phase('Saving transfers') as stats:
+            Transfer.objects.all().delete()
+            stats['rows'] = bulk_insert(Transfer, (Transfer(
+                from_station_id=from_station_id, to_station_id=to_station_id, distance=distance,
+                walk_time=walk_time, same_name=same_name)
+                for from_station_id, to_station_id, distance, walk_time, same_name in walking_transfers(
+                    list(Station.objects.values('station_id', 'station_name', 'local_x', 'local_y')),
+                    StationSynonym.objects.values_list('station_id', 'synonym'))))
+
+        errors = validate(row_counts(), live_counts, settings.DATASET_MIN_ROW_RATIO)
+        if errors and not options['force']:
+            raise CommandError('Refusing to publish the new dataset: {}'.format('; '.join(errors)))
+
+        version = dataset.compute_content_hash()
+        if snapshot_path:
+            with phase('Writing timetable snapshot') as stats:
+                stats['rows'] = write_snapshot(snapshot_path, version)
+        dataset.publish(version)
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_dataset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Departure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_id', models.CharField(max_length=30)),
+                ('station_id', models.CharField(max_length=30)),
+                ('up_down_direction', models.CharField(max_length=20)),
+                ('holiday_type', models.CharField(max_length=20)),
+                ('station_order', models.PositiveIntegerField()),
+                ('time', models.TimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stationroute',
+            index=models.Index(fields=['route', 'station_order'], name='main_statio_route_i_10e9a4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stationroute',
+            index=models.Index(fields=['station', 'station_order'], name='main_statio_station_0d22a9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['station_id', 'holiday_type', 'time'], name='main_depart_station_84365c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['route_id', 'holiday_type', 'time'], name='main_depart_route_i_291ecb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['route_id', 'station_id', 'holiday_type', 'time'], name='main_depart_route_i_d701de_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['holiday_type', 'time'], name='main_depart_holiday_523fc9_idx'),
+        ),
+    ]
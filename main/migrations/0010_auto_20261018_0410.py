@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_auto_20261018_0349'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trip',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holiday_type', models.CharField(max_length=20)),
+                ('up_down_direction', models.CharField(max_length=20)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='departure',
+            name='trip_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='departure',
+            index=models.Index(fields=['trip_id', 'station_order'], name='main_depart_trip_id_c69db6_idx'),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='route',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Route'),
+        ),
+        migrations.AddField(
+            model_name='time',
+            name='trip',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='main.Trip'),
+        ),
+    ]
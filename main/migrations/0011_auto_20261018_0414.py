@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_auto_20261018_0410'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Transfer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_station_id', models.CharField(max_length=30)),
+                ('to_station_id', models.CharField(max_length=30)),
+                ('distance', models.PositiveIntegerField()),
+                ('walk_time', models.PositiveIntegerField()),
+                ('same_name', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['from_station_id', 'walk_time'], name='main_transf_from_st_b33a85_idx'),
+        ),
+    ]
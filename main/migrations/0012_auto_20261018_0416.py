@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-17 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_auto_20261018_0414'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteHeadway',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_id', models.CharField(max_length=30)),
+                ('holiday_type', models.CharField(max_length=20)),
+                ('up_down_direction', models.CharField(max_length=20)),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('departures', models.PositiveIntegerField()),
+                ('median_headway', models.PositiveIntegerField(null=True)),
+                ('min_headway', models.PositiveIntegerField(null=True)),
+                ('max_headway', models.PositiveIntegerField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RouteSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_id', models.CharField(max_length=30)),
+                ('holiday_type', models.CharField(max_length=20)),
+                ('from_station_order', models.PositiveIntegerField()),
+                ('to_station_order', models.PositiveIntegerField()),
+                ('from_station_id', models.CharField(max_length=30)),
+                ('to_station_id', models.CharField(max_length=30)),
+                ('median_travel_time', models.PositiveIntegerField()),
+                ('samples', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RouteSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('route_id', models.CharField(max_length=30)),
+                ('holiday_type', models.CharField(max_length=20)),
+                ('up_down_direction', models.CharField(max_length=20)),
+                ('trips', models.PositiveIntegerField()),
+                ('first_departure', models.TimeField()),
+                ('last_departure', models.TimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='routesummary',
+            index=models.Index(fields=['route_id', 'holiday_type'], name='main_routes_route_i_18c7da_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routesegment',
+            index=models.Index(fields=['route_id', 'holiday_type', 'from_station_order'], name='main_routes_route_i_cab6a9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routeheadway',
+            index=models.Index(fields=['route_id', 'holiday_type', 'hour'], name='main_routeh_route_i_dd8fb3_idx'),
+        ),
+    ]
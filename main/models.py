@@ -34,11 +34,126 @@ class StationRoute(models.Model):
     station_order = models.PositiveIntegerField()
     up_down_direction = models.CharField(max_length=20)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['route', 'station_order']),
+            models.Index(fields=['station', 'station_order']),
+        ]
+
+
+class Trip(models.Model):
+    """One bus run: a timetable row of a schedule sheet on one holiday type."""
+    route = models.ForeignKey(Route, on_delete=models.CASCADE)
+    holiday_type = models.CharField(max_length=20)
+    up_down_direction = models.CharField(max_length=20)
+
+    def __str__(self):
+        return str(self.id) + '|' + self.route_id
+
 
 class Time(models.Model):
     holiday_type = models.CharField(max_length=20)
     station_route = models.ForeignKey(StationRoute, on_delete=models.CASCADE)
     time = models.TimeField()
+    trip = models.ForeignKey(Trip, null=True, on_delete=models.CASCADE)
 
     def __str__(self):
         return self.time.strftime('%H:%M')
+
+
+class Departure(models.Model):
+    """Read-optimized copy of Time joined with its StationRoute."""
+    route_id = models.CharField(max_length=30)
+    station_id = models.CharField(max_length=30)
+    up_down_direction = models.CharField(max_length=20)
+    holiday_type = models.CharField(max_length=20)
+    station_order = models.PositiveIntegerField()
+    time = models.TimeField()
+    trip_id = models.IntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip_id', 'station_order']),
+            models.Index(fields=['station_id', 'holiday_type', 'time']),
+            models.Index(fields=['route_id', 'holiday_type', 'time']),
+            models.Index(fields=['route_id', 'station_id',
+                                 'holiday_type', 'time']),
+            models.Index(fields=['holiday_type', 'time']),
+        ]
+
+    def __str__(self):
+        return self.time.strftime('%H:%M')
+
+
+class RouteSummary(models.Model):
+    """Trip count and service span of a route per holiday type and direction."""
+    route_id = models.CharField(max_length=30)
+    holiday_type = models.CharField(max_length=20)
+    up_down_direction = models.CharField(max_length=20)
+    trips = models.PositiveIntegerField()
+    first_departure = models.TimeField()
+    last_departure = models.TimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['route_id', 'holiday_type']),
+        ]
+
+
+class RouteHeadway(models.Model):
+    """Headways, in seconds, between trips starting in one hour."""
+    route_id = models.CharField(max_length=30)
+    holiday_type = models.CharField(max_length=20)
+    up_down_direction = models.CharField(max_length=20)
+    hour = models.PositiveSmallIntegerField()
+    departures = models.PositiveIntegerField()
+    median_headway = models.PositiveIntegerField(null=True)
+    min_headway = models.PositiveIntegerField(null=True)
+    max_headway = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['route_id', 'holiday_type', 'hour']),
+        ]
+
+
+class RouteSegment(models.Model):
+    """Median travel time, in seconds, between consecutive stops of a route."""
+    route_id = models.CharField(max_length=30)
+    holiday_type = models.CharField(max_length=20)
+    from_station_order = models.PositiveIntegerField()
+    to_station_order = models.PositiveIntegerField()
+    from_station_id = models.CharField(max_length=30)
+    to_station_id = models.CharField(max_length=30)
+    median_travel_time = models.PositiveIntegerField()
+    samples = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['route_id', 'holiday_type', 'from_station_order']),
+        ]
+
+
+class Transfer(models.Model):
+    """A walk between two nearby stations, stored in both directions."""
+    from_station_id = models.CharField(max_length=30)
+    to_station_id = models.CharField(max_length=30)
+    distance = models.PositiveIntegerField()  # meters
+    walk_time = models.PositiveIntegerField()  # seconds
+    same_name = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['from_station_id', 'walk_time']),
+        ]
+
+    def __str__(self):
+        return self.from_station_id + '|' + self.to_station_id
+
+
+class Dataset(models.Model):
+    version = models.CharField(max_length=64)
+    published_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.version
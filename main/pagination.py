@@ -0,0 +1,167 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only keyset pagination.
+
+    The cursor holds the ordering values of the last row on the page, so
+    every page is a range scan starting right after it; no page needs an
+    OFFSET or a COUNT(*). The queryset's ``order_by`` must be ascending and
+    end with a unique field. Sequences of rows already sorted by the view's
+    ``ordering`` are paginated with a binary search instead.
+
+    ``limit`` asks for a single page of that many rows, with no next link.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    limit_query_param = 'limit'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.page_size = self.limit or self.get_page_size(request)
+        if isinstance(queryset, QuerySet):
+            self.ordering = list(queryset.query.order_by)
+        else:
+            self.ordering = list(view.ordering)
+        assert self.ordering and not any(field.startswith('-') for field in self.ordering), \
+            'KeysetPagination requires an ascending ordering.'
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            if isinstance(queryset, QuerySet):
+                try:
+                    queryset = queryset.filter(
+                        self.get_position_filter(position))
+                except (TypeError, ValueError, DjangoValidationError):
+                    raise NotFound(self.invalid_cursor_message)
+            else:
+                queryset = self.get_rows_after(queryset, position)
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = self.limit is None and len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        value = request.query_params.get(self.page_size_query_param, None)
+        if value is not None:
+            try:
+                page_size = int(value)
+            except ValueError:
+                pass
+        return max(1, min(page_size, settings.MAX_PAGE_SIZE))
+
+    def get_limit(self, request):
+        value = request.query_params.get(self.limit_query_param, None)
+        if value is None:
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            raise ValidationError({self.limit_query_param: 'Expected an integer.'})
+        if limit < 1:
+            raise ValidationError(
+                {self.limit_query_param: 'Expected a positive integer.'})
+        return min(limit, settings.MAX_PAGE_SIZE)
+
+    def get_position_filter(self, position):
+        # (a, b) > (x, y) is written as a >= x AND (a > x OR (a = x AND b > y))
+        # so that the leading column can drive an index range scan.
+        condition = Q(**{self.ordering[-1] + '__gt': position[-1]})
+        for field, value in reversed(list(zip(self.ordering[:-1], position[:-1]))):
+            condition = Q(**{field + '__gt': value}) | (
+                Q(**{field: value}) & condition)
+        if len(self.ordering) > 1:
+            condition &= Q(**{self.ordering[0] + '__gte': position[0]})
+        return condition
+
+    def get_rows_after(self, rows, position):
+        """The rows after ``position`` in an ordered sequence. Sequences
+        with an ``after`` method, such as snapshot rows, seek themselves."""
+        if hasattr(rows, 'after'):
+            try:
+                return rows.after(position)
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return rows[self.get_position_index(rows, position):]
+
+    def get_position_index(self, rows, position):
+        """Index of the first row after ``position`` in an ordered list."""
+        lo, hi = 0, len(rows)
+        try:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.get_position(rows[mid]) <= position:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        except TypeError:
+            raise NotFound(self.invalid_cursor_message)
+        return lo
+
+    def get_position(self, obj):
+        position = []
+        for field in self.ordering:
+            value = obj[field] if isinstance(obj, dict) else getattr(obj, field)
+            if isinstance(value, (datetime.date, datetime.time)):
+                value = value.isoformat()
+            elif not isinstance(value, (int, str)):
+                value = str(value)
+            position.append(value)
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, obj):
+        return base64.urlsafe_b64encode(json.dumps(
+            self.get_position(obj), separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
@@ -0,0 +1,197 @@
+"""Earliest-arrival journey planning and reachability with the Connection
+Scan Algorithm.
+
+Every pair of consecutive stops of a trip is a connection. For each
+holiday type the connections are kept in parallel lists sorted by
+departure time, so a query is a bisect to the departure time followed by
+one forward scan that stops as soon as no later connection can improve
+the arrival at the destination. Changing buses at a stop is allowed
+whenever the next bus leaves no earlier than the previous one arrived;
+after each improved arrival the stored walking transfers from that stop
+are relaxed, so itineraries may also walk to a nearby stop, once per
+change.
+
+Only departures recorded with their trip take part.
+"""
+import bisect
+from itertools import groupby
+
+from .dataset import DatasetIndex
+from .models import Departure, Station, Transfer
+from .timetable import from_seconds, to_seconds
+
+INFINITY = 1 << 32
+DAY = 24 * 3600
+
+
+class Connections:
+    """The connections of one holiday type, sorted by departure time."""
+
+    def __init__(self, connections):
+        connections.sort()
+        self.departure_times = [c[0] for c in connections]
+        self.arrival_times = [c[1] for c in connections]
+        self.departure_stations = [c[2] for c in connections]
+        self.arrival_stations = [c[3] for c in connections]
+        self.trips = [c[4] for c in connections]
+
+    def __len__(self):
+        return len(self.trips)
+
+
+class Planner:
+
+    def __init__(self, station_ids, trips, connections, coordinates, footpaths=None):
+        self.station_ids = station_ids
+        self.station_index = {station_id: i for i, station_id in enumerate(station_ids)}
+        self.trips = trips
+        self.connections = connections
+        self.coordinates = coordinates
+        self.footpaths = footpaths or {}  # station index -> [(station index, seconds)]
+
+    @classmethod
+    def load(cls):
+        station_index = {}
+        trips = []
+        grouped = {}
+        rows = Departure.objects.filter(trip_id__isnull=False).values_list(
+            'trip_id', 'route_id', 'holiday_type', 'station_id', 'time').order_by(
+            'trip_id', 'station_order', 'time')
+        for (trip_id, route_id, holiday_type), stops in groupby(rows.iterator(), lambda row: row[:3]):
+            trip = len(trips)
+            trips.append((trip_id, route_id))
+            connections = grouped.setdefault(holiday_type, [])
+            previous = None
+            for _, _, _, station_id, time in stops:
+                station = station_index.setdefault(station_id, len(station_index))
+                seconds = to_seconds(time)
+                if previous is not None and previous[1] <= seconds:
+                    connections.append((previous[1], seconds, previous[0], station, trip))
+                previous = (station, seconds)
+        station_ids = sorted(station_index, key=station_index.get)
+        coordinates = {station_id: (str(local_x), str(local_y)) for station_id, local_x, local_y in
+                       Station.objects.values_list('station_id', 'local_x', 'local_y').iterator()}
+        footpaths = {}
+        for from_station_id, to_station_id, walk_time in Transfer.objects.values_list(
+                'from_station_id', 'to_station_id', 'walk_time').iterator():
+            if from_station_id in station_index and to_station_id in station_index:
+                footpaths.setdefault(station_index[from_station_id], []).append(
+                    (station_index[to_station_id], walk_time))
+        return cls(station_ids, trips, {holiday_type: Connections(connections)
+                                        for holiday_type, connections in grouped.items()},
+                   coordinates, footpaths)
+
+    def scan(self, origin, start, holiday_type, until=None, target=None):
+        """Scan the connections leaving from ``start`` (seconds) on.
+
+        Returns the earliest arrival time at every station index and, for
+        each station reached, how: ``('bus', boarding connection,
+        alighting connection)`` or ``('walk', from station, seconds)``.
+        The scan stops at connections leaving after ``until`` or, when
+        ``target`` is given, once no connection can reach it earlier.
+        """
+        connections = self.connections[holiday_type]
+        departure_times = connections.departure_times
+        arrival_times = connections.arrival_times
+        departure_stations = connections.departure_stations
+        arrival_stations = connections.arrival_stations
+        trips = connections.trips
+        footpaths = self.footpaths
+
+        arrival = [INFINITY] * len(self.station_ids)
+        arrival[origin] = start
+        boarded = {}  # trip -> connection where it was boarded
+        reached_by = {}
+        for station, seconds in footpaths.get(origin, ()):
+            if start + seconds < min(arrival[station], DAY):
+                arrival[station] = start + seconds
+                reached_by[station] = ('walk', origin, seconds)
+        limit = INFINITY if until is None else until
+        for i in range(bisect.bisect_left(departure_times, start), len(connections)):
+            departure_time = departure_times[i]
+            if departure_time > limit or (target is not None and departure_time >= arrival[target]):
+                break
+            trip = trips[i]
+            if trip not in boarded:
+                if arrival[departure_stations[i]] > departure_time:
+                    continue
+                boarded[trip] = i
+            station = arrival_stations[i]
+            arrival_time = arrival_times[i]
+            if arrival_time < arrival[station]:
+                arrival[station] = arrival_time
+                reached_by[station] = ('bus', boarded[trip], i)
+                for other, seconds in footpaths.get(station, ()):
+                    if arrival_time + seconds < min(arrival[other], DAY):
+                        arrival[other] = arrival_time + seconds
+                        reached_by[other] = ('walk', station, seconds)
+        return arrival, reached_by
+
+    def plan(self, origin, destination, at, holiday_type):
+        """The earliest-arrival itinerary from ``origin`` leaving at or
+        after ``at``, as a list of bus and walk legs, or None if
+        ``destination`` cannot be reached that day."""
+        if holiday_type not in self.connections or origin not in self.station_index or \
+                destination not in self.station_index:
+            return None
+        origin = self.station_index[origin]
+        target = self.station_index[destination]
+        if origin == target:
+            return []
+        arrival, reached_by = self.scan(origin, to_seconds(at), holiday_type, target=target)
+        if target not in reached_by:
+            return None
+
+        connections = self.connections[holiday_type]
+        legs = []
+        station = target
+        arrival_time = arrival[target]
+        while station != origin:
+            how = reached_by[station]
+            if how[0] == 'walk':
+                _, previous, seconds = how
+                legs.append({
+                    'type': 'walk',
+                    'from_station_id': self.station_ids[previous],
+                    'to_station_id': self.station_ids[station],
+                    'departure': from_seconds(arrival_time - seconds).isoformat(),
+                    'arrival': from_seconds(arrival_time).isoformat(),
+                })
+                arrival_time -= seconds
+            else:
+                _, board, alight = how
+                trip_id, route_id = self.trips[connections.trips[board]]
+                previous = connections.departure_stations[board]
+                legs.append({
+                    'type': 'bus',
+                    'trip_id': trip_id,
+                    'route_id': route_id,
+                    'from_station_id': self.station_ids[previous],
+                    'to_station_id': self.station_ids[station],
+                    'departure': from_seconds(connections.departure_times[board]).isoformat(),
+                    'arrival': from_seconds(connections.arrival_times[alight]).isoformat(),
+                })
+                arrival_time = connections.departure_times[board]
+            station = previous
+        legs.reverse()
+        return legs
+
+    def reachable(self, origin, at, within, holiday_type):
+        """Every station reachable from ``origin`` leaving at or after
+        ``at`` and arriving within ``within`` seconds, with its earliest
+        arrival, soonest first."""
+        start = to_seconds(at)
+        if holiday_type not in self.connections or origin not in self.station_index:
+            return [{'station_id': origin, 'arrival': from_seconds(start).isoformat(), 'minutes': 0}]
+        until = start + within
+        arrival, _ = self.scan(self.station_index[origin], start, holiday_type, until=until)
+        reached = sorted((seconds, self.station_ids[station])
+                         for station, seconds in enumerate(arrival) if seconds <= until)
+        return [{
+            'station_id': station_id,
+            'arrival': from_seconds(seconds).isoformat(),
+            'minutes': (seconds - start) // 60,
+        } for seconds, station_id in reached]
+
+
+planner = DatasetIndex(Planner.load)
@@ -0,0 +1,54 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def dumps(data):
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False,
+                      separators=(',', ':'))
+
+
+def encode_chunks(pieces, size):
+    """Join rendered pieces into UTF-8 chunks of ``size`` pieces each."""
+    buffer = []
+    for piece in pieces:
+        buffer.append(piece)
+        if len(buffer) >= size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+class NDJSONRenderer(BaseRenderer):
+    """One JSON document per line. List views stream it row by row."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(dumps(row) + '\n' for row in rows).encode('utf-8')
+
+    def render_stream(self, rows):
+        yield from (dumps(row) + '\n' for row in rows)
+
+
+class StreamingJSONRenderer(BaseRenderer):
+    """A plain JSON array that list views stream row by row."""
+    media_type = 'application/json'
+    format = 'jsonstream'
+    charset = None
+    streaming = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return dumps(data).encode('utf-8')
+
+    def render_stream(self, rows):
+        separator = '['
+        for row in rows:
+            yield separator + dumps(row)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
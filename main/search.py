@@ -0,0 +1,241 @@
+"""In-memory station name search and autocomplete.
+
+Station names and synonyms are normalized (lower-cased, whitespace
+removed) and indexed by their character unigrams and bigrams, so a query
+only verifies the stations that share all of its n-grams instead of
+scanning every name. A second index over the Hangul initial consonants
+(choseong) of each name answers queries such as ``ㅈㅈㄱㅎ``, and those
+that mix consonants with syllables, such as ``제주ㄱ``.
+
+Autocomplete keeps every key in a sorted list, so the completions of a
+prefix are a contiguous run found with one bisect.
+"""
+import bisect
+from .dataset import DatasetIndex
+from .models import Route, Station, StationSynonym
+from .serializers import StationSerializer
+
+CHOSEONG = 'ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ'
+HANGUL_BASE = 0xAC00
+HANGUL_COUNT = 11172
+JUNGSEONG_JONGSEONG_COUNT = 588
+
+NAME = 0
+SYNONYM = 1
+
+EXACT = 0
+PREFIX = 1
+SUBSTRING = 2
+
+
+def normalize(s):
+    return ''.join(s.lower().split())
+
+
+def choseong(s):
+    """Replace every precomposed Hangul syllable with its initial consonant."""
+    result = []
+    for ch in s:
+        code = ord(ch) - HANGUL_BASE
+        if 0 <= code < HANGUL_COUNT:
+            ch = CHOSEONG[code // JUNGSEONG_JONGSEONG_COUNT]
+        result.append(ch)
+    return ''.join(result)
+
+
+def is_choseong(s):
+    return all(ch in CHOSEONG for ch in s)
+
+
+def has_choseong(s):
+    return any(ch in CHOSEONG for ch in s)
+
+
+def find(text, initials, query):
+    """Position of the first match of ``query`` in ``text``, whose
+    initials are ``initials``, or -1. An initial consonant in ``query``
+    matches any syllable that starts with it."""
+    pattern = choseong(query)
+    position = initials.find(pattern)
+    while position >= 0:
+        if all(ch in CHOSEONG or ch == text[position + i] for i, ch in enumerate(query)):
+            return position
+        position = initials.find(pattern, position + 1)
+    return -1
+
+
+def ngrams(s):
+    """Unigrams and bigrams of ``s``; a query's n-grams must all occur in
+    any text that contains it."""
+    return set(s) | {s[i:i + 2] for i in range(len(s) - 1)}
+
+
+def query_ngrams(s):
+    if len(s) < 2:
+        return set(s)
+    return {s[i:i + 2] for i in range(len(s) - 1)}
+
+
+class StationSearch:
+    """Ranked substring search over station names and synonyms.
+
+    ``rows`` are station dictionaries with at least ``station_id`` and
+    ``station_name``; ``synonyms`` are (station_id, synonym) pairs.
+    """
+
+    def __init__(self, rows, synonyms=()):
+        self.rows = rows
+        index = {row['station_id']: i for i, row in enumerate(rows)}
+        self._stations = []
+        self._kinds = []
+        self._texts = []
+        self._initials = []
+        self._text_postings = {}
+        self._initial_postings = {}
+        terms = [(i, NAME, row['station_name']) for i, row in enumerate(rows)]
+        terms += [(index[station_id], SYNONYM, synonym)
+                  for station_id, synonym in synonyms if station_id in index]
+        for term, (station, kind, text) in enumerate(terms):
+            text = normalize(text)
+            initials = choseong(text)
+            self._stations.append(station)
+            self._kinds.append(kind)
+            self._texts.append(text)
+            self._initials.append(initials)
+            for gram in ngrams(text):
+                self._text_postings.setdefault(gram, []).append(term)
+            for gram in ngrams(initials):
+                self._initial_postings.setdefault(gram, []).append(term)
+
+    @classmethod
+    def load(cls):
+        rows = list(Station.objects.values(
+            *StationSerializer.fields).order_by('station_id'))
+        synonyms = StationSynonym.objects.values_list(
+            'station_id', 'synonym').order_by('id')
+        return cls(rows, synonyms)
+
+    def _candidates(self, postings, query):
+        candidates = None
+        for gram in sorted(query_ngrams(query), key=lambda gram: len(postings.get(gram, ()))):
+            terms = postings.get(gram, ())
+            candidates = set(terms) if candidates is None else candidates.intersection(terms)
+            if not candidates:
+                break
+        return candidates or ()
+
+    def search(self, query, limit):
+        """Stations whose name or a synonym contains ``query``, best first.
+
+        Exact matches rank before prefix matches, which rank before other
+        substring matches; names rank before synonyms and shorter texts
+        before longer ones. Initial consonants in the query match any
+        syllable starting with them.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        by_initials = has_choseong(query)
+        if by_initials:
+            terms = self._candidates(self._initial_postings, choseong(query))
+        else:
+            terms = self._candidates(self._text_postings, query)
+
+        ranks = {}
+        for term in terms:
+            text = self._texts[term]
+            if by_initials:
+                position = find(text, self._initials[term], query)
+            else:
+                position = text.find(query)
+            if position < 0:
+                continue
+            match = EXACT if position == 0 and len(text) == len(query) else PREFIX if position == 0 else SUBSTRING
+            rank = (match, self._kinds[term], len(text))
+            station = self._stations[term]
+            if station not in ranks or rank < ranks[station]:
+                ranks[station] = rank
+        stations = sorted(ranks, key=lambda station: (
+            ranks[station], self.rows[station]['station_name'], self.rows[station]['station_id']))
+        return [self.rows[station] for station in stations[:limit]]
+
+    def contains(self, needle):
+        """Ids of the stations whose name contains ``needle``, ignoring case."""
+        needle = needle.lower()
+        query = normalize(needle)
+        terms = self._candidates(self._text_postings, query) if query else range(len(self._texts))
+        station_ids = set()
+        for term in terms:
+            row = self.rows[self._stations[term]]
+            if self._kinds[term] == NAME and needle in row['station_name'].lower():
+                station_ids.add(row['station_id'])
+        return frozenset(station_ids)
+
+
+class Autocomplete:
+    """Prefix completion over station names, station synonyms and route
+    numbers.
+
+    ``entries`` are (type, id, name, key) tuples; every entry is indexed
+    by its normalized key and by the initials of that key.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        keys = []
+        for i, (_, _, _, key) in enumerate(self.entries):
+            key = normalize(key)
+            keys.append((key, i))
+            initials = choseong(key)
+            if initials != key:
+                keys.append((initials, i))
+        keys.sort()
+        self._keys = [key for key, _ in keys]
+        self._entries = [i for _, i in keys]
+
+    @classmethod
+    def load(cls):
+        stations = dict(Station.objects.values_list('station_id', 'station_name'))
+        entries = [('station', station_id, station_name, station_name)
+                   for station_id, station_name in stations.items()]
+        entries += [('station', station_id, stations[station_id], synonym)
+                    for station_id, synonym in StationSynonym.objects.values_list(
+                        'station_id', 'synonym').order_by('id')
+                    if station_id in stations]
+        entries += [('route', route_id, route_number, route_number)
+                    for route_id, route_number in Route.objects.values_list(
+                        'route_id', 'route_number').order_by('route_id')]
+        return cls(entries)
+
+    def complete(self, prefix, limit, kind=None):
+        """The first ``limit`` distinct entries of type ``kind``, if given,
+        in key order, with a key starting with ``prefix``. Initial
+        consonants in ``prefix`` match any syllable starting with them."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        # A prefix mixing initials with syllables is looked up by its
+        # initials, and the syllables are checked against each key.
+        mixed = has_choseong(prefix) and not is_choseong(prefix)
+        start = choseong(prefix) if mixed else prefix
+        results = []
+        seen = set()
+        for i in range(bisect.bisect_left(self._keys, start), len(self._keys)):
+            if not self._keys[i].startswith(start):
+                break
+            entry_type, entry_id, name, key = self.entries[self._entries[i]]
+            if (kind is not None and entry_type != kind) or (entry_type, entry_id) in seen:
+                continue
+            if mixed:
+                key = normalize(key)[:len(prefix)]
+                if find(key, choseong(key), prefix) != 0:
+                    continue
+            seen.add((entry_type, entry_id))
+            results.append({'type': entry_type, 'id': entry_id, 'name': name})
+            if len(results) == limit:
+                break
+        return results
+
+
+station_search = DatasetIndex(StationSearch.load)
+autocomplete = DatasetIndex(Autocomplete.load)
@@ -1,38 +1,85 @@
-from rest_framework import serializers
+import datetime
 
-from .models import Route, Station, StationRoute, Time
 
+class ValuesSerializer:
+    """Serializes the dictionaries returned by ``QuerySet.values()``.
 
-class RouteSerializer(serializers.HyperlinkedModelSerializer):
-    class Meta:
-        model = Route
-        fields = ('route_type', 'route_id', 'route_number')
+    This skips model instantiation and DRF's per-field machinery. ``fields``
+    are both the selected columns and the output keys, in output order;
+    ``converters`` turn the values that are not plain JSON into the
+    representation DRF would have produced.
+    """
+    fields = ()
+    converters = {}
 
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
 
-class StationSerializer(serializers.HyperlinkedModelSerializer):
-    class Meta:
-        model = Station
-        fields = ('local_x', 'local_y', 'station_id', 'station_name')
+    @classmethod
+    def values(cls, queryset):
+        """Select the serialized columns, plus any ordering column that
+        pagination needs to build its cursor."""
+        ordering = [field for field in queryset.query.order_by
+                    if field not in cls.fields]
+        return queryset.values(*cls.fields, *ordering)
 
+    @classmethod
+    def to_representation(cls, row):
+        data = {field: row[field] for field in cls.fields}
+        for field, converter in cls.converters.items():
+            data[field] = converter(data[field])
+        return data
 
-class StationRouteSerializer(serializers.HyperlinkedModelSerializer):
-    route_id = serializers.CharField(source='route.route_id')
-    station_id = serializers.CharField(source='station.station_id')
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+        return self.to_representation(self.instance)
 
-    class Meta:
-        model = StationRoute
-        fields = ('route_id', 'station_id',
-                  'station_order', 'up_down_direction')
 
+class RouteSerializer(ValuesSerializer):
+    fields = ('route_type', 'route_id', 'route_number')
 
-class TimeSerializer(serializers.HyperlinkedModelSerializer):
-    route_id = serializers.CharField(source='station_route.route.route_id')
-    station_id = serializers.CharField(
-        source='station_route.station.station_id')
-    up_down_direction = serializers.CharField(
-        source='station_route.up_down_direction')
 
-    class Meta:
-        model = Time
-        fields = ('holiday_type', 'route_id', 'station_id',
-                  'up_down_direction', 'time')
+class StationSerializer(ValuesSerializer):
+    fields = ('local_x', 'local_y', 'station_id', 'station_name')
+    converters = {'local_x': str, 'local_y': str}
+
+
+class StationRouteSerializer(ValuesSerializer):
+    fields = ('route_id', 'station_id',
+              'station_order', 'up_down_direction')
+
+
+class DepartureSerializer(ValuesSerializer):
+    fields = ('holiday_type', 'route_id', 'station_id',
+              'up_down_direction', 'time')
+    converters = {'time': datetime.time.isoformat}
+
+
+class RouteSummarySerializer(ValuesSerializer):
+    fields = ('holiday_type', 'up_down_direction', 'trips', 'first_departure', 'last_departure')
+    converters = {'first_departure': datetime.time.isoformat, 'last_departure': datetime.time.isoformat}
+
+
+class RouteHeadwaySerializer(ValuesSerializer):
+    fields = ('hour', 'departures', 'median_headway', 'min_headway', 'max_headway')
+
+
+class RouteSegmentSerializer(ValuesSerializer):
+    fields = ('holiday_type', 'from_station_order', 'to_station_order', 'from_station_id', 'to_station_id',
+              'median_travel_time', 'samples')
+
+
+class TransferSerializer(ValuesSerializer):
+    fields = ('to_station_id', 'distance', 'walk_time', 'same_name')
+
+
+class TripSerializer(ValuesSerializer):
+    fields = ('id', 'route_id', 'holiday_type', 'up_down_direction')
+
+
+class TripStopSerializer(ValuesSerializer):
+    fields = ('station_id', 'station_order', 'time')
+    converters = {'time': datetime.time.isoformat}
@@ -0,0 +1,389 @@
+"""Memory-mapped binary snapshot of the timetable.
+
+The file is a header, a section table and a list of sections, each a
+fixed-width ``array`` of one type code. Strings live in a single UTF-8
+blob indexed by an offsets array. Departures are stored sorted by
+(station, holiday type, direction, time, id) and station routes by
+(route, direction, station_order, id); CSR offsets and index permutations
+give every station and route one contiguous range per partition, so a
+lookup only bisects and merges a few ranges and decodes just the rows it
+returns.
+
+Every worker maps the same file read-only, so all processes share a
+single page-cache copy and opening a snapshot costs a few milliseconds.
+"""
+import datetime
+import heapq
+import mmap
+import os
+import struct
+from array import array
+from itertools import islice
+
+from django.conf import settings
+
+from .dataset import DatasetIndex, current_version
+from .models import Departure, Route, Station, StationRoute
+from .timetable import from_seconds, to_seconds
+
+MAGIC = b'JJBS'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHH64sI')  # magic, format, reserved, dataset version, sections
+SECTION = struct.Struct('<32sc7xQQ')  # name, type code, offset, length in bytes
+ALIGNMENT = 8
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def csr_offsets(keys, size):
+    """Offsets of each key's range in a list sorted by ``keys``."""
+    offsets = array('I', [0]) * (size + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    return offsets
+
+
+class SnapshotWriter:
+
+    def __init__(self):
+        self.strings = {}
+        self.sections = []
+
+    def intern(self, value):
+        if value not in self.strings:
+            self.strings[value] = len(self.strings)
+        return self.strings[value]
+
+    def add(self, name, values):
+        self.sections.append((name, values))
+
+    def write(self, path, version):
+        blob = bytearray()
+        string_offsets = array('I', [0])
+        for value in self.strings:
+            blob += value.encode('utf-8')
+            string_offsets.append(len(blob))
+        sections = self.sections + [
+            ('strings', array('B', blob)),
+            ('string_offsets', string_offsets),
+        ]
+
+        offset = HEADER.size + SECTION.size * len(sections)
+        table = []
+        for name, values in sections:
+            offset += -offset % ALIGNMENT
+            length = len(values) * values.itemsize
+            table.append((name, values, offset))
+            offset += length
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0,
+                                version.encode('ascii'), len(sections)))
+            for name, values, offset in table:
+                f.write(SECTION.pack(name.encode('ascii'), values.typecode.encode('ascii'),
+                                     offset, len(values) * values.itemsize))
+            for name, values, offset in table:
+                f.write(b'\0' * (offset - f.tell()))
+                values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+def write_snapshot(path, version):
+    """Write the loaded dataset to ``path``, replacing it atomically.
+
+    Returns the number of station route and departure records written.
+    """
+    writer = SnapshotWriter()
+
+    stations = list(Station.objects.values_list(
+        'station_id', 'station_name', 'local_x', 'local_y').order_by('station_id'))
+    station_index = {row[0]: i for i, row in enumerate(stations)}
+    writer.add('station_id', array(
+        'I', (writer.intern(row[0]) for row in stations)))
+    writer.add('station_name', array(
+        'I', (writer.intern(row[1]) for row in stations)))
+    writer.add('station_x', array('d', (float(row[2]) for row in stations)))
+    writer.add('station_y', array('d', (float(row[3]) for row in stations)))
+
+    routes = list(Route.objects.values_list(
+        'route_id', 'route_number', 'route_type').order_by('route_id'))
+    route_index = {row[0]: i for i, row in enumerate(routes)}
+    writer.add('route_id', array(
+        'I', (writer.intern(row[0]) for row in routes)))
+    writer.add('route_number', array(
+        'I', (writer.intern(row[1]) for row in routes)))
+    writer.add('route_type', array(
+        'I', (writer.intern(row[2]) for row in routes)))
+
+    station_routes = [
+        (route_index[route_id], up_down_direction, station_order, id, station_index[station_id])
+        for id, route_id, station_id, station_order, up_down_direction in StationRoute.objects.values_list(
+            'id', 'route_id', 'station_id', 'station_order', 'up_down_direction').iterator()
+        if route_id in route_index and station_id in station_index]
+    departures = [
+        (station_index[station_id], holiday_type, up_down_direction, to_seconds(time), id, route_index[route_id])
+        for id, station_id, route_id, up_down_direction, holiday_type, time in Departure.objects.values_list(
+            'id', 'station_id', 'route_id', 'up_down_direction', 'holiday_type', 'time').iterator()
+        if route_id in route_index and station_id in station_index]
+
+    # Rows are partitioned by direction, and departures also by holiday
+    # type, so every filter combination is a few contiguous ranges.
+    directions = sorted({row[1] for row in station_routes} | {row[2] for row in departures})
+    holiday_types = sorted({row[1] for row in departures})
+    writer.add('directions', array('I', (writer.intern(value) for value in directions)))
+    writer.add('holiday_types', array('I', (writer.intern(value) for value in holiday_types)))
+    direction_index = {value: i for i, value in enumerate(directions)}
+    holiday_type_index = {value: i for i, value in enumerate(holiday_types)}
+    partitions = len(holiday_types) * len(directions)
+
+    station_routes = [(route, direction_index[direction], station_order, id, station)
+                      for route, direction, station_order, id, station in station_routes]
+    station_routes.sort()
+    writer.add('sr_route', array('I', (row[0] for row in station_routes)))
+    writer.add('sr_direction', array('I', (row[1] for row in station_routes)))
+    writer.add('sr_order', array('I', (row[2] for row in station_routes)))
+    writer.add('sr_id', array('I', (row[3] for row in station_routes)))
+    writer.add('sr_station', array('I', (row[4] for row in station_routes)))
+    writer.add('route_sr_offsets', csr_offsets(
+        (row[0] * len(directions) + row[1] for row in station_routes), len(routes) * len(directions)))
+    by_station = sorted(range(len(station_routes)), key=lambda i: (
+        station_routes[i][4], station_routes[i][1], station_routes[i][2], station_routes[i][3]))
+    writer.add('station_sr_index', array('I', by_station))
+    writer.add('station_sr_offsets', csr_offsets(
+        (station_routes[i][4] * len(directions) + station_routes[i][1] for i in by_station),
+        len(stations) * len(directions)))
+    records = len(station_routes)
+    del station_routes, by_station
+
+    departures = [(station, holiday_type_index[holiday_type] * len(directions) + direction_index[direction],
+                   seconds, id, route)
+                  for station, holiday_type, direction, seconds, id, route in departures]
+    departures.sort()
+    writer.add('dep_station', array('I', (row[0] for row in departures)))
+    writer.add('dep_partition', array('I', (row[1] for row in departures)))
+    writer.add('dep_time', array('I', (row[2] for row in departures)))
+    writer.add('dep_id', array('I', (row[3] for row in departures)))
+    writer.add('dep_route', array('I', (row[4] for row in departures)))
+    writer.add('station_dep_offsets', csr_offsets(
+        (row[0] * partitions + row[1] for row in departures), len(stations) * partitions))
+    by_route = sorted(range(len(departures)), key=lambda i: (
+        departures[i][4], departures[i][1], departures[i][2], departures[i][3]))
+    writer.add('route_dep_index', array('I', by_route))
+    writer.add('route_dep_offsets', csr_offsets(
+        (departures[i][4] * partitions + departures[i][1] for i in by_route), len(routes) * partitions))
+    records += len(departures)
+
+    writer.write(path, version)
+    return records
+
+
+def bisect_key(rows, key, value, right=False):
+    """Position of the first of ``rows`` whose ``key`` is not less than
+    ``value``, or greater than it when ``right``."""
+    lo, hi = 0, len(rows)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(rows[mid]) < value or (right and key(rows[mid]) == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class SnapshotRows:
+    """Rows of one or more record ranges, each sorted by ``key``, read in
+    merged ``key`` order.
+
+    Records are decoded only as they are iterated, so taking a page costs
+    the page, not the ranges. ``after`` seeks a keyset pagination position
+    by binary search.
+    """
+
+    def __init__(self, ranges, key, decode, parse_position):
+        self.ranges = [rows for rows in ranges if len(rows)]
+        self.key = key
+        self.decode = decode
+        self.parse_position = parse_position
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.ranges)
+
+    def __iter__(self):
+        if len(self.ranges) == 1:
+            return map(self.decode, self.ranges[0])
+        return map(self.decode, heapq.merge(*self.ranges, key=self.key))
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError('SnapshotRows only supports slices')
+        return list(islice(self, index.start, index.stop))
+
+    def after(self, position):
+        """The rows following the ordering values ``position``."""
+        value = self.parse_position(position)
+        return SnapshotRows([rows[bisect_key(rows, self.key, value, right=True):] for rows in self.ranges],
+                            self.key, self.decode, self.parse_position)
+
+
+class Snapshot:
+    """Read-only, zero-copy view of a snapshot file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, _, version, count = HEADER.unpack_from(
+            self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError('Unsupported snapshot format')
+        self.version = version.rstrip(b'\0').decode('ascii')
+        buffer = memoryview(self._mmap)
+        self._sections = {}
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(
+                self._mmap, HEADER.size + SECTION.size * i)
+            if offset + length > len(self._mmap):
+                raise SnapshotError('Truncated snapshot')
+            self._sections[name.rstrip(b'\0').decode('ascii')] = buffer[offset:offset + length].cast(
+                typecode.decode('ascii'))
+        self._strings = {}
+        self._station_index = {self.string(x): i for i, x in enumerate(
+            self._sections['station_id'])}
+        self._route_index = {self.string(x): i for i, x in enumerate(
+            self._sections['route_id'])}
+        self._directions = [self.string(x) for x in self._sections['directions']]
+        self._holiday_types = [self.string(x) for x in self._sections['holiday_types']]
+
+    def __getitem__(self, name):
+        return self._sections[name]
+
+    def string(self, i):
+        if i not in self._strings:
+            offsets = self._sections['string_offsets']
+            self._strings[i] = bytes(
+                self._sections['strings'][offsets[i]:offsets[i + 1]]).decode('utf-8')
+        return self._strings[i]
+
+    def _ranges(self, offsets, first, partitions, index=None):
+        """The record ranges of ``partitions`` of the entity whose first
+        partition is ``first``, through ``index`` if given."""
+        offsets = self[offsets]
+        if index is None:
+            return [range(offsets[first + p], offsets[first + p + 1]) for p in partitions]
+        return [index[offsets[first + p]:offsets[first + p + 1]] for p in partitions]
+
+    @staticmethod
+    def _select(values, value):
+        if value is None:
+            return range(len(values))
+        return [values.index(value)] if value in values else []
+
+    def departures(self, station_id=None, route_id=None, holiday_type=None, up_down_direction=None,
+                   after=None, before=None):
+        """Departure rows ordered by (time, id), of ``station_id`` or of
+        ``route_id``; ``after`` (inclusive) and ``before`` (exclusive)
+        bound the time."""
+        if (station_id is None) == (route_id is None):
+            raise ValueError('Exactly one of station_id and route_id is required')
+        directions = len(self._directions)
+        partitions = [h * directions + d
+                      for h in self._select(self._holiday_types, holiday_type)
+                      for d in self._select(self._directions, up_down_direction)]
+        partition_count = len(self._holiday_types) * directions
+        if station_id is not None:
+            station = self._station_index.get(station_id, None)
+            ranges = [] if station is None else self._ranges(
+                'station_dep_offsets', station * partition_count, partitions)
+        else:
+            route = self._route_index.get(route_id, None)
+            ranges = [] if route is None else self._ranges(
+                'route_dep_offsets', route * partition_count, partitions, self['route_dep_index'])
+
+        dep_station, dep_partition, dep_time = self['dep_station'], self['dep_partition'], self['dep_time']
+        dep_id, dep_route = self['dep_id'], self['dep_route']
+        station_ids, route_ids = self['station_id'], self['route_id']
+
+        def key(i):
+            return dep_time[i], dep_id[i]
+
+        def decode(i):
+            holiday, direction = divmod(dep_partition[i], directions)
+            return {
+                'id': dep_id[i],
+                'holiday_type': self._holiday_types[holiday],
+                'route_id': self.string(route_ids[dep_route[i]]),
+                'station_id': self.string(station_ids[dep_station[i]]),
+                'up_down_direction': self._directions[direction],
+                'time': from_seconds(dep_time[i]),
+            }
+
+        def parse_position(position):
+            time, id = position
+            return to_seconds(datetime.time.fromisoformat(time)), int(id)
+
+        if after is not None:
+            ranges = [rows[bisect_key(rows, key, (to_seconds(after),)):] for rows in ranges]
+        if before is not None:
+            ranges = [rows[:bisect_key(rows, key, (to_seconds(before),))] for rows in ranges]
+        return SnapshotRows(ranges, key, decode, parse_position)
+
+    def station_routes(self, route_id=None, station_id=None, up_down_direction=None):
+        """Station route rows ordered by (station_order, id), of
+        ``route_id`` or of ``station_id``."""
+        if (station_id is None) == (route_id is None):
+            raise ValueError('Exactly one of station_id and route_id is required')
+        directions = len(self._directions)
+        partitions = self._select(self._directions, up_down_direction)
+        if route_id is not None:
+            route = self._route_index.get(route_id, None)
+            ranges = [] if route is None else self._ranges(
+                'route_sr_offsets', route * directions, partitions)
+        else:
+            station = self._station_index.get(station_id, None)
+            ranges = [] if station is None else self._ranges(
+                'station_sr_offsets', station * directions, partitions, self['station_sr_index'])
+
+        sr_route, sr_station, sr_order = self['sr_route'], self['sr_station'], self['sr_order']
+        sr_id, sr_direction = self['sr_id'], self['sr_direction']
+        station_ids, route_ids = self['station_id'], self['route_id']
+
+        def key(i):
+            return sr_order[i], sr_id[i]
+
+        def decode(i):
+            return {
+                'id': sr_id[i],
+                'route_id': self.string(route_ids[sr_route[i]]),
+                'station_id': self.string(station_ids[sr_station[i]]),
+                'station_order': sr_order[i],
+                'up_down_direction': self._directions[sr_direction[i]],
+            }
+
+        def parse_position(position):
+            station_order, id = position
+            return int(station_order), int(id)
+
+        return SnapshotRows(ranges, key, decode, parse_position)
+
+
+def load_snapshot():
+    """Open the configured snapshot if it matches the current dataset."""
+    path = settings.TIMETABLE_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, struct.error, SnapshotError):
+        return None
+    if snapshot.version != current_version():
+        return None
+    return snapshot
+
+
+snapshot = DatasetIndex(load_snapshot)
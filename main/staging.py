@@ -0,0 +1,177 @@
+"""Building a new dataset beside the live SQLite database and swapping it in.
+
+updatedb imports into a copy of the database, so readers keep querying the
+live file, unaffected by the import's write transactions, until the
+finished copy atomically replaces it with a rename. Queries already running
+finish on the file they opened; every new connection, so with the default
+``CONN_MAX_AGE`` every new request, sees the new dataset. The replaced file
+stays beside the live one for ``updatedb --rollback``.
+
+Writes to the live database while an import runs, such as admin edits, are
+lost when the copy replaces it.
+"""
+import os
+import shutil
+import sqlite3
+from contextlib import closing, contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from . import dataset
+from .models import Dataset, Departure, Route, Station, StationRoute, Time
+
+STAGING_SUFFIX = '.staging'
+PREVIOUS_SUFFIX = '.previous'
+
+VALIDATED_MODELS = (Route, Station, StationRoute, Time, Departure)
+
+
+class StagingError(Exception):
+    pass
+
+
+def row_counts():
+    return {model.__name__: model.objects.count() for model in VALIDATED_MODELS}
+
+
+def validate(counts, live_counts, ratio):
+    """Why the staged dataset should not replace the live one: a table that
+    is empty or shrank below ``ratio`` of its live size."""
+    errors = []
+    for name, rows in counts.items():
+        live_rows = live_counts.get(name, 0)
+        if not rows:
+            errors.append('{} is empty'.format(name))
+        elif rows < live_rows * ratio:
+            errors.append('{} has {} rows, down from {}'.format(name, rows, live_rows))
+    return errors
+
+
+def remove(path):
+    for name in (path, path + '-journal', path + '-wal', path + '-shm'):
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+
+
+def fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def link(path, dest):
+    """Make ``dest`` another name for ``path``, or a copy of it where the
+    file system has no hard links."""
+    try:
+        os.link(path, dest)
+    except OSError:
+        shutil.copy2(path, dest)
+
+
+def keep_previous(path):
+    """Keep the current file at ``path`` as its ``.previous``."""
+    if not os.path.exists(path):
+        return
+    tmp_path = path + PREVIOUS_SUFFIX + '.tmp'
+    remove(tmp_path)
+    link(path, tmp_path)
+    os.replace(tmp_path, path + PREVIOUS_SUFFIX)
+
+
+def exchange(path):
+    """Swap the file at ``path`` with its ``.previous``. ``path`` is
+    replaced by a single rename, so it never goes missing."""
+    previous = path + PREVIOUS_SUFFIX
+    tmp_path = previous + '.tmp'
+    remove(tmp_path)
+    link(path, tmp_path)
+    os.replace(previous, path)
+    os.replace(tmp_path, previous)
+
+
+def is_stageable():
+    return connection.vendor == 'sqlite' and not connection.is_in_memory_db()
+
+
+@contextmanager
+def staged_database():
+    """Run the block against a copy of the live database and swap the copy
+    in when the block completes. If it raises, the copy is discarded and
+    the live database is left untouched.
+
+    Yields the path the block is to write the staged dataset's timetable
+    snapshot to, or None when snapshots are disabled. The snapshot is
+    renamed into place just before the database, so a worker that sees the
+    new dataset version also finds its snapshot.
+
+    Databases other than on-disk SQLite are updated in place, snapshot
+    included.
+    """
+    snapshot_path = settings.TIMETABLE_SNAPSHOT_PATH
+    if not is_stageable():
+        yield snapshot_path
+        return
+    live = connection.settings_dict['NAME']
+    if not os.path.exists(live):
+        raise StagingError('Database {} does not exist; run migrate first'.format(live))
+    staging = live + STAGING_SUFFIX
+    staged_snapshot = snapshot_path + STAGING_SUFFIX if snapshot_path else None
+    remove(staging)
+    if staged_snapshot:
+        remove(staged_snapshot)
+    with closing(sqlite3.connect(live)) as source, closing(sqlite3.connect(staging)) as target:
+        source.backup(target)
+
+    connection.close()
+    connection.settings_dict['NAME'] = staging
+    try:
+        with connection.cursor() as cursor:
+            # A crash only loses the copy, so skip the sync on every commit;
+            # the file is synced once before the swap.
+            cursor.execute('PRAGMA synchronous = OFF')
+        yield staged_snapshot
+        connection.close()
+        fsync(staging)
+    except BaseException:
+        connection.close()
+        connection.settings_dict['NAME'] = live
+        remove(staging)
+        if staged_snapshot:
+            remove(staged_snapshot)
+        raise
+    connection.settings_dict['NAME'] = live
+    swaps = [(staging, live)]
+    if staged_snapshot and os.path.exists(staged_snapshot):
+        swaps.insert(0, (staged_snapshot, snapshot_path))
+    # Both previous files are kept before either live file changes, so they
+    # always form a pair.
+    for staged, path in swaps:
+        keep_previous(path)
+    for staged, path in swaps:
+        os.replace(staged, path)
+
+
+def rollback():
+    """Swap the live database, and the timetable snapshot, with the ones
+    they replaced, then publish the restored dataset again so that its
+    Last-Modified moves forward. Rolling back twice restores the newer
+    dataset."""
+    if not is_stageable():
+        raise StagingError('Rollback needs an on-disk SQLite database')
+    live = connection.settings_dict['NAME']
+    if not os.path.exists(live + PREVIOUS_SUFFIX):
+        raise StagingError('No previous dataset to roll back to')
+    connection.close()
+    # The snapshot goes first, as when publishing.
+    snapshot_path = settings.TIMETABLE_SNAPSHOT_PATH
+    if snapshot_path and os.path.exists(snapshot_path) and os.path.exists(snapshot_path + PREVIOUS_SUFFIX):
+        exchange(snapshot_path)
+    exchange(live)
+    restored = Dataset.objects.order_by('-id').first()
+    if restored is not None:
+        dataset.publish(restored.version, force=True)
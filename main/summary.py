@@ -0,0 +1,67 @@
+"""Per-route timetable aggregates materialized by updatedb.
+
+All aggregates come from one pass over the departures of recorded trips,
+read in (trip, station_order) order: each trip contributes its start time
+to its route's service span and headways, and each pair of consecutive
+stops one travel-time sample to its segment.
+"""
+import statistics
+from itertools import groupby
+
+from .timetable import from_seconds, to_seconds
+
+
+def median(values):
+    return int(round(statistics.median(values)))
+
+
+def summarize(rows):
+    """Aggregate (trip_id, route_id, holiday_type, up_down_direction,
+    station_order, station_id, time) rows ordered by trip and stop.
+
+    Returns the field values of the RouteSummary, RouteHeadway and
+    RouteSegment rows.
+    """
+    starts = {}  # (route_id, holiday_type, up_down_direction) -> [seconds]
+    samples = {}  # (route_id, holiday_type, from order, to order, from station, to station) -> [seconds]
+    for (trip_id, route_id, holiday_type), stops in groupby(rows, lambda row: row[:3]):
+        previous = None
+        for _, _, _, up_down_direction, station_order, station_id, time in stops:
+            seconds = to_seconds(time)
+            if previous is None:
+                starts.setdefault((route_id, holiday_type, up_down_direction), []).append(seconds)
+            elif previous[2] <= seconds:
+                samples.setdefault((route_id, holiday_type, previous[0], station_order, previous[1], station_id),
+                                   []).append(seconds - previous[2])
+            previous = (station_order, station_id, seconds)
+
+    summaries = []
+    headways = []
+    for (route_id, holiday_type, up_down_direction), times in sorted(starts.items()):
+        times.sort()
+        key = {'route_id': route_id, 'holiday_type': holiday_type, 'up_down_direction': up_down_direction}
+        summaries.append(dict(key, trips=len(times), first_departure=from_seconds(times[0]),
+                              last_departure=from_seconds(times[-1])))
+        # Each headway belongs to the hour of the later of its two trips.
+        gaps = [(later // 3600, later - earlier) for earlier, later in zip(times, times[1:])]
+        departures = {hour: len(list(group)) for hour, group in groupby(times, lambda t: t // 3600)}
+        by_hour = {hour: [gap for _, gap in group] for hour, group in groupby(gaps, lambda gap: gap[0])}
+        for hour, count in sorted(departures.items()):
+            gaps = by_hour.get(hour)
+            headways.append(dict(key, hour=hour, departures=count,
+                                 median_headway=median(gaps) if gaps else None,
+                                 min_headway=min(gaps) if gaps else None,
+                                 max_headway=max(gaps) if gaps else None))
+
+    segments = [{
+        'route_id': route_id,
+        'holiday_type': holiday_type,
+        'from_station_order': from_station_order,
+        'to_station_order': to_station_order,
+        'from_station_id': from_station_id,
+        'to_station_id': to_station_id,
+        'median_travel_time': median(values),
+        'samples': len(values),
+    } for (route_id, holiday_type, from_station_order, to_station_order, from_station_id, to_station_id), values
+        in sorted(samples.items())]
+    return summaries, headways, segments
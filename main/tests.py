@@ -1,3 +1,853 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from main import dataset, holidays, staging
+from main.management.commands import exportgtfs, updatedb
+from main.models import Dataset, Departure, Route, Station, StationRoute, Time, Trip
+from main.pagination import KeysetPagination
+from main.planner import Connections, Planner
+from main.search import Autocomplete, StationSearch
+from main.serializers import DepartureSerializer, StationRouteSerializer
+from main.snapshot import FORMAT_VERSION, Snapshot, load_snapshot, write_snapshot
+from main.snapshot import snapshot as snapshot_index
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers each path with the statuses queued for it in ``server.responses``,
+    then with 200 and its ``server.bodies`` entry, or the path, as the body."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        statuses = self.server.responses.get(self.path, [])
+        status = statuses.pop(0) if statuses else 200
+        body = b'error' if status >= 400 else self.server.bodies.get(self.path, self.path.encode('utf-8'))
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(DOWNLOAD_RETRIES=2, DOWNLOAD_BACKOFF=0.05, DOWNLOAD_TIMEOUT=5)
+class DownloadTests(SimpleTestCase):
+    """updatedb's download layer against a local stand-in HTTP server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = []
+        self.server.responses = {}
+        self.server.bodies = {}
+        self.dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dest)
+        self.session = updatedb.create_session()
+        self.addCleanup(self.session.close)
+
+    def download(self, path):
+        with mock.patch.object(updatedb.tqdm, 'write'):
+            return updatedb.download(self.session, self.url + path, self.dest)
+
+    def test_download(self):
+        path = self.download('/sched/fast')
+        self.assertEqual(path, os.path.join(self.dest, 'fast.xlsx'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'/sched/fast')
+        self.assertEqual(self.server.requests, ['/sched/fast'])
+
+    def test_server_errors_are_retried_with_backoff(self):
+        self.server.responses['/sched/night'] = [503, 502]
+        started = time.monotonic()
+        path = self.download('/sched/night')
+        elapsed = time.monotonic() - started
+        self.assertIsNotNone(path)
+        self.assertEqual(self.server.requests, ['/sched/night'] * 3)
+        # urllib3 retries the first failure at once and backs off
+        # DOWNLOAD_BACKOFF * 2 before the second retry.
+        self.assertGreaterEqual(elapsed, 0.1)
+
+    def test_server_errors_give_up_after_retries(self):
+        self.server.responses['/sched/night'] = [500] * 5
+        with self.assertRaises(requests.exceptions.RetryError):
+            self.download('/sched/night')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.responses['/sched/missing'] = [404]
+        self.assertIsNone(self.download('/sched/missing'))
+        self.assertEqual(self.server.requests, ['/sched/missing'])
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_open_api_client_error(self):
+        self.server.responses['/api/Bus'] = [403]
+        with override_settings(BUS_OPEN_API_URL=self.url + '/api/'):
+            with self.assertRaises(requests.exceptions.HTTPError):
+                updatedb.get_all_routes(self.session)
+        self.assertEqual(self.server.requests, ['/api/Bus'])
+
+    def test_open_api_server_errors_are_retried(self):
+        self.server.responses['/api/Bus'] = [503]
+        self.server.bodies['/api/Bus'] = (
+            b'<response><body><items><item><routeId>R1</routeId></item>'
+            b'<item><routeId>R2</routeId></item></items></body></response>')
+        with override_settings(BUS_OPEN_API_URL=self.url + '/api/'):
+            routes = updatedb.get_all_routes(self.session)
+        self.assertEqual([route['routeId'] for route in routes], ['R1', 'R2'])
+        self.assertEqual(self.server.requests, ['/api/Bus'] * 2)
+
+
+@override_settings(TIMETABLE_SNAPSHOT_PATH=None)
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Station.objects.create(station_id='S1', station_name='시청', local_x='126.5', local_y='33.5')
+        # Several departures share a time, so pages split ties on the
+        # leading ordering column. Each has its own route to tell them apart
+        # in API responses.
+        for i, minutes in enumerate((480, 480, 480, 485, 490, 490, 540, 545, 600)):
+            Route.objects.create(route_id='R{}'.format(i), route_type='1', route_number=str(100 + i))
+            Departure.objects.create(
+                route_id='R{}'.format(i), station_id='S1', up_down_direction='0', holiday_type='1',
+                station_order=1, time=datetime.time(minutes // 60, minutes % 60))
+        cls.ids = list(Departure.objects.order_by('time', 'id').values_list('id', flat=True))
+
+    def queryset(self):
+        return DepartureSerializer.values(Departure.objects.order_by('time', 'id'))
+
+    def paginate(self, rows, query=''):
+        """Follow next links from the first page; return the id of every
+        page's rows."""
+        view = SimpleNamespace(ordering=('time', 'id'))
+        pages = []
+        url = '/times/?' + query
+        while url is not None:
+            paginator = KeysetPagination()
+            page = paginator.paginate_queryset(rows, Request(APIRequestFactory().get(url)), view)
+            pages.append([row['id'] for row in page])
+            url = paginator.get_next_link()
+            self.assertTrue(len(pages) <= len(self.ids) + 1, 'pagination does not terminate')
+        return pages
+
+    def assertPages(self, pages, ids, page_size):
+        self.assertEqual(pages, [ids[i:i + page_size] for i in range(0, len(ids), page_size)] or [[]])
+
+    def test_queryset_ties(self):
+        for page_size in (1, 2, 4, 20):
+            self.assertPages(self.paginate(self.queryset(), 'page_size={}'.format(page_size)),
+                             self.ids, page_size)
+
+    def test_list_ties(self):
+        for page_size in (1, 2, 4, 20):
+            self.assertPages(self.paginate(list(self.queryset()), 'page_size={}'.format(page_size)),
+                             self.ids, page_size)
+
+    def test_snapshot_rows_ties(self):
+        path = os.path.join(tempfile.mkdtemp(), 'timetable.snapshot')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        write_snapshot(path, 'test')
+        snapshot = Snapshot(path)
+        for page_size in (1, 2, 4, 20):
+            self.assertPages(self.paginate(snapshot.departures(station_id='S1'), 'page_size={}'.format(page_size)),
+                             self.ids, page_size)
+
+    def test_limit_is_a_single_page(self):
+        for rows in (self.queryset(), list(self.queryset())):
+            self.assertEqual(self.paginate(rows, 'limit=3'), [self.ids[:3]])
+
+    def test_invalid_cursor(self):
+        view = SimpleNamespace(ordering=('time', 'id'))
+        for cursor in ('nonsense', 'WyIwODowMCJd', 'WzEsMl0='):  # garbage, too short, wrong types
+            for rows in (self.queryset(), list(self.queryset())):
+                request = Request(APIRequestFactory().get('/times/', {'cursor': cursor}))
+                with self.assertRaises(NotFound):
+                    KeysetPagination().paginate_queryset(rows, request, view)
+
+    def test_time_window_with_cursor(self):
+        expected = list(Departure.objects.filter(
+            time__gte=datetime.time(8, 0), time__lt=datetime.time(9, 0)).order_by(
+            'time', 'id').values_list('route_id', flat=True))
+        self.assertEqual(len(expected), 6)
+        for page_size in (1, 2, 4):
+            ids = []
+            url = '/times/?station_id=S1&after=08:00&before=09:00&page_size={}'.format(page_size)
+            while url is not None:
+                data = self.client.get(url).json()
+                self.assertLessEqual(len(data['results']), page_size)
+                ids.extend(row['route_id'] for row in data['results'])
+                url = data['next']
+                self.assertLessEqual(len(ids), len(expected), 'pagination does not terminate')
+                if url is not None:
+                    # The window is kept alongside the cursor.
+                    query = parse_qs(urlparse(url).query)
+                    self.assertEqual((query['after'], query['before']), (['08:00'], ['09:00']))
+            self.assertEqual(ids, expected)
+
+
+@override_settings(DATASET_CHECK_INTERVAL=3600)
+class ResponseCacheTests(TestCase):
+    """Dataset-versioned ETags and the server-side response cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Route.objects.create(route_id='R1', route_type='1', route_number='100')
+        Route.objects.create(route_id='R2', route_type='1', route_number='200')
+
+    def setUp(self):
+        caches[settings.RESPONSE_CACHE].clear()
+        dataset.publish('v1')
+        # Later tests look the dataset up again rather than reuse this one.
+        self.addCleanup(setattr, dataset, '_checked_at', None)
+
+    def get(self, url, **extra):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **extra)
+
+    def test_hit_skips_the_database(self):
+        first = self.get('/routes/')
+        with self.assertNumQueries(0):
+            second = self.get('/routes/')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_query_parameter_order(self):
+        first = self.get('/routes/?route_type=1&page_size=1')
+        with self.assertNumQueries(0):
+            second = self.get('/routes/?page_size=1&route_type=1')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_accept_is_part_of_the_key(self):
+        json = self.get('/routes/')
+        html = self.client.get('/routes/', HTTP_ACCEPT='text/html')
+        self.assertTrue(html['Content-Type'].startswith('text/html'))
+        self.assertNotEqual(html['ETag'], json['ETag'])
+        # The browsable API is not cached, so the JSON entry is intact.
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get('/routes/').content, json.content)
+
+    def test_publish_invalidates(self):
+        first = self.get('/routes/')
+        Route.objects.create(route_id='R3', route_type='1', route_number='300')
+        # Until a new dataset is published, the cached body is served.
+        self.assertEqual(self.get('/routes/').content, first.content)
+        dataset.publish('v2')
+        second = self.get('/routes/')
+        self.assertEqual([route['route_id'] for route in second.json()['results']], ['R1', 'R2', 'R3'])
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.get('/routes/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_not_modified(self):
+        first = self.get('/routes/')
+        response = self.get('/routes/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], first['ETag'])
+
+    def test_etag_follows_the_renderer_format(self):
+        json = self.client.get('/routes/?format=json')
+        api = self.client.get('/routes/?format=api')
+        self.assertNotEqual(json['ETag'], api['ETag'])
+        self.assertEqual(self.client.get('/routes/?format=api',
+                                         HTTP_IF_NONE_MATCH=json['ETag']).status_code, 200)
+
+
+class SnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for station_id in ('S1', 'S2', 'S3'):
+            Station.objects.create(station_id=station_id, station_name=station_id, local_x='126.5', local_y='33.5')
+        for route_id in ('R1', 'R2'):
+            Route.objects.create(route_id=route_id, route_type='1', route_number=route_id)
+        for route_id, station_id, station_order, direction in (
+                ('R1', 'S1', 1, '0'), ('R1', 'S2', 2, '0'), ('R1', 'S2', 1, '1'), ('R1', 'S1', 2, '1'),
+                ('R2', 'S2', 1, '0'), ('R2', 'S3', 2, '0')):
+            StationRoute.objects.create(route_id=route_id, station_id=station_id,
+                                        station_order=station_order, up_down_direction=direction)
+        # R2 only runs on weekdays, so its other partitions are empty; S3
+        # has no departures at all.
+        for route_id, station_id, station_order, direction, holiday_type, minutes in (
+                ('R1', 'S1', 1, '0', '1', 480), ('R1', 'S2', 2, '0', '1', 490),
+                ('R1', 'S1', 1, '0', '1', 480), ('R1', 'S1', 1, '0', '2', 540),
+                ('R1', 'S2', 1, '1', '1', 500), ('R1', 'S1', 2, '1', '1', 510),
+                ('R1', 'S2', 1, '1', '3', 600), ('R2', 'S2', 1, '0', '1', 485)):
+            Departure.objects.create(route_id=route_id, station_id=station_id, station_order=station_order,
+                                     up_down_direction=direction, holiday_type=holiday_type,
+                                     time=datetime.time(minutes // 60, minutes % 60))
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'timetable.snapshot')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def write(self, version='v1'):
+        records = write_snapshot(self.path, version)
+        self.assertEqual(records, StationRoute.objects.count() + Departure.objects.count())
+        return Snapshot(self.path)
+
+    def test_departures(self):
+        snapshot = self.write()
+        for key, value in [('route_id', 'R1'), ('route_id', 'R2'), ('station_id', 'S1'), ('station_id', 'S2'),
+                           ('station_id', 'S3'), ('route_id', 'unknown')]:
+            for holiday_type in (None, '1', '2', '3', '9'):
+                for direction in (None, '0', '1'):
+                    with self.subTest(key=key, value=value, holiday_type=holiday_type, direction=direction):
+                        queryset = Departure.objects.filter(**{key: value})
+                        filters = {}
+                        if holiday_type is not None:
+                            filters['holiday_type'] = holiday_type
+                        if direction is not None:
+                            filters['up_down_direction'] = direction
+                        expected = list(DepartureSerializer.values(
+                            queryset.filter(**filters).order_by('time', 'id')))
+                        self.assertEqual(list(snapshot.departures(**{key: value}, **filters)), expected)
+
+    def test_station_routes(self):
+        snapshot = self.write()
+        for key, value in [('route_id', 'R1'), ('route_id', 'R2'), ('station_id', 'S2'), ('station_id', 'S3')]:
+            for direction in (None, '0', '1'):
+                with self.subTest(key=key, value=value, direction=direction):
+                    queryset = StationRoute.objects.filter(**{key: value})
+                    if direction is not None:
+                        queryset = queryset.filter(up_down_direction=direction)
+                    expected = list(StationRouteSerializer.values(queryset.order_by('station_order', 'id')))
+                    rows = snapshot.station_routes(**{key: value}, up_down_direction=direction)
+                    self.assertEqual(list(rows), expected)
+
+    def test_offsets(self):
+        snapshot = self.write()
+        partitions = len(snapshot['holiday_types']) * len(snapshot['directions'])
+        offsets = snapshot['station_dep_offsets']
+        self.assertEqual(len(offsets), len(snapshot['station_id']) * partitions + 1)
+        self.assertEqual(offsets[0], 0)
+        self.assertEqual(offsets[-1], Departure.objects.count())
+        for i in range(len(offsets) - 1):
+            station, partition = divmod(i, partitions)
+            for record in range(offsets[i], offsets[i + 1]):
+                self.assertEqual((snapshot['dep_station'][record], snapshot['dep_partition'][record]),
+                                 (station, partition))
+        # S3 has station routes but no departures.
+        s3 = [snapshot.string(i) for i in snapshot['station_id']].index('S3')
+        self.assertEqual(offsets[s3 * partitions], offsets[(s3 + 1) * partitions])
+
+    def test_truncated_file(self):
+        self.write()
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        for length in (0, 10, len(content) // 2, len(content) - 8, len(content) - 1):
+            with self.subTest(length=length):
+                with open(self.path, 'wb') as f:
+                    f.write(content[:length])
+                with override_settings(TIMETABLE_SNAPSHOT_PATH=self.path), \
+                        mock.patch('main.snapshot.current_version', return_value='v1'):
+                    self.assertIsNone(load_snapshot())
+
+    def test_format_version_mismatch(self):
+        self.write()
+        with open(self.path, 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<H', FORMAT_VERSION + 1))
+        with override_settings(TIMETABLE_SNAPSHOT_PATH=self.path), \
+                mock.patch('main.snapshot.current_version', return_value='v1'):
+            self.assertIsNone(load_snapshot())
+
+    @override_settings(DATASET_CHECK_INTERVAL=3600)
+    def test_dataset_version_mismatch(self):
+        caches[settings.RESPONSE_CACHE].clear()
+        self.addCleanup(setattr, dataset, '_checked_at', None)
+        dataset.publish('v1')
+        self.write('v1')
+        Departure.objects.filter(station_id='S2').delete()
+        dataset.publish('v2')
+        with override_settings(TIMETABLE_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(load_snapshot())
+            with mock.patch.object(Snapshot, 'departures') as departures:
+                response = self.client.get('/times/?station_id=S2&format=json')
+            departures.assert_not_called()
+        self.assertEqual(response.json()['results'], [])
+
+
+@override_settings(TIMETABLE_SNAPSHOT_PATH=None, DATASET_CHECK_INTERVAL=3600)
+class BatchLookupTests(TestCase):
+
+    STATIONS = ['ST{:02}'.format(i) for i in range(20)]
+
+    @classmethod
+    def setUpTestData(cls):
+        Route.objects.create(route_id='R1', route_type='1', route_number='100')
+        for order, station_id in enumerate(cls.STATIONS, 1):
+            Station.objects.create(station_id=station_id, station_name=station_id, local_x='126.5', local_y='33.5')
+            StationRoute.objects.create(route_id='R1', station_id=station_id, station_order=order,
+                                        up_down_direction='0')
+            for hour in (8, 9, 10):
+                Departure.objects.create(route_id='R1', station_id=station_id, station_order=order,
+                                         up_down_direction='0', holiday_type='1', time=datetime.time(hour, order))
+
+    def setUp(self):
+        caches[settings.RESPONSE_CACHE].clear()
+        self.addCleanup(setattr, dataset, '_checked_at', None)
+        dataset.publish('v1')
+        dataset.current_dataset()
+
+    def batch(self, path, ids, query=''):
+        return self.client.get('{}?station_id={}&format=json{}'.format(path, ','.join(ids), query))
+
+    def test_constant_queries(self):
+        for path in ('/times/batch/', '/stationroutes/batch/'):
+            for ids in (self.STATIONS[:1], self.STATIONS[:3], self.STATIONS):
+                with self.subTest(path=path, ids=len(ids)), self.assertNumQueries(1):
+                    response = self.batch(path, ids)
+                    self.assertEqual(list(response.json()), ids)
+
+    def test_snapshot(self):
+        path = os.path.join(tempfile.mkdtemp(), 'timetable.snapshot')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        urls = ('/times/batch/', '/stationroutes/batch/')
+        expected = [self.batch(url, self.STATIONS, '&limit=2').json() for url in urls]
+        # A new version, so that the snapshot index is loaded again.
+        write_snapshot(path, dataset.publish('batch').version)
+        dataset.current_dataset()
+        with override_settings(TIMETABLE_SNAPSHOT_PATH=path):
+            self.assertIsNotNone(snapshot_index.get())
+            for url, rows in zip(urls, expected):
+                with self.subTest(url=url), self.assertNumQueries(0):
+                    self.assertEqual(self.batch(url, self.STATIONS, '&limit=2').json(), rows)
+
+    def test_rows(self):
+        data = self.batch('/times/batch/', ['ST01', 'ST00', 'unknown'], '&after=09:00').json()
+        self.assertEqual(list(data), ['ST01', 'ST00', 'unknown'])
+        self.assertEqual([row['time'] for row in data['ST01']], ['09:02:00', '10:02:00'])
+        self.assertEqual(data['unknown'], [])
+        data = self.batch('/stationroutes/batch/', ['ST01', 'ST00']).json()
+        self.assertEqual([row['station_order'] for row in data['ST01']], [2])
+
+    def test_limit_truncates_each_id(self):
+        data = self.batch('/times/batch/', self.STATIONS, '&limit=2').json()
+        self.assertEqual({len(rows) for rows in data.values()}, {2})
+        self.assertEqual([row['time'] for row in data['ST05']], ['08:06:00', '09:06:00'])
+
+    def test_row_cap(self):
+        with mock.patch('main.views.BATCH_MAX_ROWS', 50):
+            self.assertEqual(self.batch('/times/batch/', self.STATIONS).status_code, 400)
+            # 20 ids of at most 2 rows each fit.
+            self.assertEqual(self.batch('/times/batch/', self.STATIONS, '&limit=2').status_code, 200)
+
+
+@contextmanager
+def file_database(path):
+    """Point the default connection at the SQLite file ``path``. The
+    in-memory test database stays open meanwhile."""
+    with mock.patch.object(connection, 'connection', None), \
+            mock.patch.dict(connection.settings_dict, NAME=path):
+        try:
+            yield
+        finally:
+            connection.close()
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class StagingTests(SimpleTestCase):
+    """updatedb's staged import and rollback against a SQLite file."""
+
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.template = tempfile.mkdtemp()
+        with file_database(os.path.join(cls.template, 'db.sqlite3')):
+            call_command('migrate', verbosity=0)
+            Route.objects.create(route_id='R1', route_type='1', route_number='100')
+            for order, station_id in enumerate(('S1', 'S2'), 1):
+                Station.objects.create(station_id=station_id, station_name=station_id, local_x='126.5',
+                                       local_y='33.5')
+                station_route = StationRoute.objects.create(route_id='R1', station_id=station_id,
+                                                            station_order=order, up_down_direction='0')
+                for hour in (8, 9):
+                    Time.objects.create(station_route=station_route, holiday_type='1',
+                                        time=datetime.time(hour, order))
+                    Departure.objects.create(route_id='R1', station_id=station_id, station_order=order,
+                                             up_down_direction='0', holiday_type='1',
+                                             time=datetime.time(hour, order))
+            version = dataset.publish().version
+            write_snapshot(os.path.join(cls.template, 'timetable.snapshot'), version)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.template)
+        super().tearDownClass()
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for name in os.listdir(self.template):
+            shutil.copy2(os.path.join(self.template, name), directory)
+        self.live = os.path.join(directory, 'db.sqlite3')
+        self.snapshot = os.path.join(directory, 'timetable.snapshot')
+        stack = ExitStack()
+        self.addCleanup(stack.close)
+        stack.enter_context(file_database(self.live))
+        stack.enter_context(override_settings(TIMETABLE_SNAPSHOT_PATH=self.snapshot, DATASET_MIN_ROW_RATIO=0.5))
+        self.addCleanup(setattr, dataset, '_checked_at', None)
+
+    def updatedb(self, routes=(), **options):
+        """Run updatedb with the downloads replaced by ``routes``."""
+        with mock.patch.object(updatedb, 'fetch_all', return_value=(list(routes), [], [])), \
+                mock.patch.object(updatedb, 'parse_workbooks', return_value=[]), \
+                mock.patch('sys.stdout'), mock.patch('sys.stderr'):
+            call_command('updatedb', **options)
+
+    def assertUnchanged(self, files):
+        for path, content in files.items():
+            self.assertEqual(read(path), content)
+        self.assertEqual(connection.settings_dict['NAME'], self.live)
+        for path in files:
+            for suffix in (staging.STAGING_SUFFIX, staging.PREVIOUS_SUFFIX):
+                self.assertFalse(os.path.exists(path + suffix), path + suffix)
+
+    def assertSnapshotMatches(self):
+        self.assertEqual(Snapshot(self.snapshot).version, dataset.current_version())
+
+    def test_failure_discards_the_copy(self):
+        files = {self.live: read(self.live), self.snapshot: read(self.snapshot)}
+        with self.assertRaises(RuntimeError):
+            with staging.staged_database() as snapshot_path:
+                self.assertEqual(connection.settings_dict['NAME'], self.live + staging.STAGING_SUFFIX)
+                Route.objects.all().delete()
+                write_snapshot(snapshot_path, 'unfinished')
+                raise RuntimeError
+        self.assertUnchanged(files)
+        self.assertEqual(Route.objects.count(), 1)
+
+    def test_validation_failure_keeps_the_live_dataset(self):
+        files = {self.live: read(self.live), self.snapshot: read(self.snapshot)}
+        with self.assertRaisesMessage(CommandError, 'Departure is empty'):
+            self.updatedb(clear_db=True)
+        self.assertUnchanged(files)
+
+    def test_validate(self):
+        live = {'Route': 100, 'Time': 1000}
+        for counts, expected in (
+                ({'Route': 100, 'Time': 1000}, []),
+                ({'Route': 50, 'Time': 2000}, []),
+                ({'Route': 49, 'Time': 1000}, ['Route has 49 rows, down from 100']),
+                ({'Route': 0, 'Time': 1000}, ['Route is empty']),
+                ({'Route': 100, 'Time': 0}, ['Time is empty'])):
+            with self.subTest(counts=counts):
+                self.assertEqual(staging.validate(counts, live, 0.5), expected)
+        # A first import has nothing to shrink from, but must not be empty.
+        self.assertEqual(staging.validate({'Route': 1, 'Time': 0}, {}, 0.5), ['Time is empty'])
+
+    def test_update_keeps_the_previous_pair(self):
+        files = {self.live: read(self.live), self.snapshot: read(self.snapshot)}
+        self.updatedb(routes=[{'routeTp': '1', 'routeId': 'R2', 'routeNum': '200'}])
+        self.assertEqual(sorted(Route.objects.values_list('route_id', flat=True)), ['R1', 'R2'])
+        self.assertSnapshotMatches()
+        for path, content in files.items():
+            self.assertEqual(read(path + staging.PREVIOUS_SUFFIX), content)
+            self.assertFalse(os.path.exists(path + staging.STAGING_SUFFIX))
+
+    def test_rollback_twice(self):
+        self.updatedb(routes=[{'routeTp': '1', 'routeId': 'R2', 'routeNum': '200'}])
+        updated = Dataset.objects.order_by('-id').first()
+        with mock.patch('sys.stdout'):
+            call_command('updatedb', rollback=True)
+        self.assertEqual(list(Route.objects.values_list('route_id', flat=True)), ['R1'])
+        self.assertSnapshotMatches()
+        restored = Dataset.objects.order_by('-id').first()
+        self.assertNotEqual(restored.version, updated.version)
+        self.assertGreater(restored.published_at, updated.published_at)
+
+        staging.rollback()
+        self.assertEqual(sorted(Route.objects.values_list('route_id', flat=True)), ['R1', 'R2'])
+        self.assertSnapshotMatches()
+        self.assertEqual(dataset.current_version(), updated.version)
+
+    def test_rollback_without_previous(self):
+        with self.assertRaises(staging.StagingError):
+            staging.rollback()
+
+
+class ExportGtfsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        route = Route.objects.create(route_id='N1', route_type='1', route_number='900')
+        trip = Trip.objects.create(route=route, holiday_type=holidays.WEEKDAY, up_down_direction='0')
+        for order, (station_id, hour, minute) in enumerate(
+                (('S1', 23, 40), ('S2', 23, 50), ('S3', 0, 10), ('S4', 0, 30)), 1):
+            Departure.objects.create(
+                route_id='N1', station_id=station_id, up_down_direction='0', holiday_type=holidays.WEEKDAY,
+                station_order=order, time=datetime.time(hour, minute), trip_id=trip.id)
+        cls.trip_id = str(trip.id)
+
+    def export(self):
+        path = os.path.join(tempfile.mkdtemp(), 'gtfs.zip')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with mock.patch('sys.stdout'), mock.patch('sys.stderr'):
+            call_command('exportgtfs', path, start_date='20260101', end_date='20261231')
+        with zipfile.ZipFile(path) as archive:
+            return list(csv.reader(io.TextIOWrapper(archive.open('stop_times.txt'), encoding='utf-8')))
+
+    def test_trip_past_midnight(self):
+        self.assertEqual(self.export()[1:], [
+            [self.trip_id, '23:40:00', '23:40:00', 'S1', '1'],
+            [self.trip_id, '23:50:00', '23:50:00', 'S2', '2'],
+            [self.trip_id, '24:10:00', '24:10:00', 'S3', '3'],
+            [self.trip_id, '24:30:00', '24:30:00', 'S4', '4'],
+        ])
+
+    def test_stop_times(self):
+        times = [datetime.time(*t) for t in ((5, 0), (23, 59, 30), (0, 0, 5), (0, 0, 5), (23, 0), (1, 0))]
+        self.assertEqual(list(exportgtfs.stop_times(times)),
+                         ['05:00:00', '23:59:30', '24:00:05', '24:00:05', '47:00:00', '49:00:00'])
+
+
+class HolidayTests(SimpleTestCase):
+
+    # (date, holiday_type, why)
+    CASES = (
+        ('2023-01-23', holidays.HOLIDAY, 'Seollal'),
+        ('2023-01-24', holidays.HOLIDAY, 'substitute for Seollal on a Sunday'),
+        ('2023-01-25', holidays.WEEKDAY, ''),
+        ('2023-05-29', holidays.HOLIDAY, "substitute for Buddha's Birthday on a Saturday"),
+        ('2023-09-28', holidays.HOLIDAY, 'Chuseok eve'),
+        ('2023-09-30', holidays.HOLIDAY, 'day after Chuseok, on a Saturday'),
+        ('2023-10-02', holidays.HOLIDAY, 'temporary holiday'),
+        ('2024-02-12', holidays.HOLIDAY, 'substitute for Seollal on a Sunday'),
+        ('2024-02-13', holidays.WEEKDAY, ''),
+        ('2024-05-06', holidays.HOLIDAY, "substitute for Children's Day on a Sunday"),
+        ('2024-09-18', holidays.HOLIDAY, 'day after Chuseok'),
+        ('2024-09-19', holidays.WEEKDAY, ''),
+        ('2024-10-01', holidays.HOLIDAY, 'Armed Forces Day, declared for 2024'),
+        ('2025-05-05', holidays.HOLIDAY, "Children's Day and Buddha's Birthday"),
+        ('2025-05-06', holidays.HOLIDAY, "substitute for Children's Day and Buddha's Birthday overlapping"),
+        ('2025-10-08', holidays.HOLIDAY, 'substitute for Chuseok eve on a Sunday'),
+        ('2025-10-10', holidays.WEEKDAY, ''),
+        ('2026-02-18', holidays.HOLIDAY, 'day after Seollal'),
+        ('2026-03-02', holidays.HOLIDAY, 'substitute for Independence Movement Day on a Sunday'),
+        ('2026-05-25', holidays.HOLIDAY, "substitute for Buddha's Birthday on a Sunday"),
+        ('2026-08-17', holidays.HOLIDAY, 'substitute for Liberation Day on a Saturday'),
+        ('2026-09-28', holidays.WEEKDAY, 'Chuseok ending on a Saturday is not substituted'),
+        ('2026-10-05', holidays.HOLIDAY, 'substitute for National Foundation Day on a Saturday'),
+        ('2027-02-09', holidays.HOLIDAY, 'substitute for Seollal on a Sunday'),
+        ('2027-10-04', holidays.HOLIDAY, 'substitute for National Foundation Day on a Sunday'),
+        ('2027-10-11', holidays.HOLIDAY, 'substitute for Hangul Day on a Saturday'),
+        ('2027-12-27', holidays.HOLIDAY, 'substitute for Christmas on a Saturday'),
+        ('2028-10-03', holidays.HOLIDAY, 'Chuseok and National Foundation Day'),
+        ('2028-10-05', holidays.HOLIDAY, 'substitute for Chuseok overlapping National Foundation Day'),
+        ('2028-10-06', holidays.WEEKDAY, ''),
+        ('2029-05-05', holidays.HOLIDAY, "Children's Day on a Saturday"),
+        ('2029-05-07', holidays.HOLIDAY, "substitute for Children's Day on a Saturday"),
+        ('2020-10-05', holidays.WEEKDAY, 'no substitute for National Foundation Day before 2021'),
+        ('2020-08-17', holidays.HOLIDAY, 'temporary holiday'),
+        ('2026-10-17', holidays.SATURDAY, ''),
+        ('2026-10-18', holidays.HOLIDAY, 'Sunday'),
+    )
+
+    def test_holiday_type(self):
+        for value, expected, why in self.CASES:
+            with self.subTest(date=value, why=why):
+                self.assertEqual(holidays.holiday_type(holidays.parse_date(value)), expected)
+
+    def test_years_outside_the_table(self):
+        with self.assertRaises(ValueError):
+            holidays.holiday_type(datetime.date(2031, 1, 6))
+        self.assertEqual(holidays.holiday_type(datetime.date(2031, 1, 5)), holidays.HOLIDAY)
+
+
+class StationSearchTests(SimpleTestCase):
+
+    ROWS = [
+        {'station_id': 'S1', 'station_name': '제주국제공항'},
+        {'station_id': 'S2', 'station_name': '제주시청'},
+        {'station_id': 'S3', 'station_name': '제주버스터미널'},
+        {'station_id': 'S4', 'station_name': '시청앞'},
+        {'station_id': 'S5', 'station_name': '한라병원'},
+    ]
+    SYNONYMS = [('S3', '시외버스터미널')]
+
+    # (query, station ids best first, why)
+    CASES = (
+        ('제주시청', ['S2'], 'full name'),
+        ('제주 시청', ['S2'], 'whitespace is ignored'),
+        ('시청', ['S4', 'S2'], 'prefix before substring'),
+        ('시', ['S4', 'S3', 'S2'], 'single syllable; a synonym prefix before name substrings'),
+        ('버스터미널', ['S3'], 'substring of the name and of a synonym'),
+        ('시외', ['S3'], 'synonym'),
+        ('ㅈㅈㄱㅈㄱㅎ', ['S1'], 'choseong of the full name'),
+        ('ㅈㅈ', ['S2', 'S1', 'S3'], 'choseong prefix, shorter names first'),
+        ('ㅎ', ['S5', 'S1'], 'single choseong'),
+        ('제주ㄱ', ['S1'], 'syllables then choseong'),
+        ('ㅈ주ㅅ', ['S2'], 'choseong around a syllable'),
+        ('ㄱ제ㄱ', ['S1'], 'mixed substring'),
+        ('제주ㅎ', [], 'mixed query without a match'),
+        ('서울', [], 'no match'),
+        ('', [], 'empty query'),
+    )
+
+    def setUp(self):
+        self.search = StationSearch(self.ROWS, self.SYNONYMS)
+
+    def test_search(self):
+        for query, expected, why in self.CASES:
+            with self.subTest(query=query, why=why):
+                self.assertEqual([row['station_id'] for row in self.search.search(query, 10)], expected)
+
+    def test_limit(self):
+        self.assertEqual([row['station_id'] for row in self.search.search('ㅈㅈ', 2)], ['S2', 'S1'])
+
+    def test_contains(self):
+        # Names only, as the updatedb Resolver matches sheet headers.
+        for needle, expected in (('시청', {'S2', 'S4'}), ('시외', set()), ('터미널', {'S3'}),
+                                 ('', {'S1', 'S2', 'S3', 'S4', 'S5'})):
+            with self.subTest(needle=needle):
+                self.assertEqual(self.search.contains(needle), expected)
+
+
+class AutocompleteTests(TestCase):
+
+    ENTRIES = [
+        ('station', 'S1', '제주국제공항', '제주국제공항'),
+        ('station', 'S2', '제주시청', '제주시청'),
+        ('station', 'S1', '제주국제공항', '제주공항'),
+        ('station', 'S1', '제주국제공항', '공항'),
+        ('route', 'R1', '100', '100'),
+        ('route', 'R2', '101', '101'),
+        ('route', 'R3', '1000', '1000'),
+        ('route', 'R4', '200', '200'),
+    ]
+
+    # (prefix, type, (type, id) in key order, why)
+    CASES = (
+        ('제주', None, [('station', 'S1'), ('station', 'S2')], 'name and synonym of S1 give one entry'),
+        ('제주 시', None, [('station', 'S2')], 'whitespace is ignored'),
+        ('공', None, [('station', 'S1')], 'synonym'),
+        ('ㅈㅈㅅ', None, [('station', 'S2')], 'choseong'),
+        ('ㄱㅎ', None, [('station', 'S1')], 'choseong of a synonym'),
+        ('제주ㅅ', None, [('station', 'S2')], 'syllables then choseong'),
+        ('ㅈ주ㄱ', None, [('station', 'S1')], 'choseong around a syllable'),
+        ('제주ㅎ', None, [], 'mixed prefix without a match'),
+        ('주', None, [], 'not a prefix'),
+        ('10', None, [('route', 'R1'), ('route', 'R3'), ('route', 'R2')], 'route numbers in key order'),
+        ('10', 'route', [('route', 'R1'), ('route', 'R3'), ('route', 'R2')], 'type filter'),
+        ('10', 'station', [], 'type filter without a match'),
+        ('3', None, [], 'no match'),
+        ('', None, [], 'empty prefix'),
+    )
+
+    def setUp(self):
+        self.autocomplete = Autocomplete(self.ENTRIES)
+
+    def test_complete(self):
+        for prefix, kind, expected, why in self.CASES:
+            with self.subTest(prefix=prefix, kind=kind, why=why):
+                self.assertEqual([(row['type'], row['id']) for row in self.autocomplete.complete(
+                    prefix, 10, kind=kind)], expected)
+
+    def test_limit_and_names(self):
+        self.assertEqual(self.autocomplete.complete('공항', 10), [
+            {'type': 'station', 'id': 'S1', 'name': '제주국제공항'}])
+        self.assertEqual([row['id'] for row in self.autocomplete.complete('1', 2)], ['R1', 'R3'])
+
+    def test_view(self):
+        Route.objects.create(route_id='R1', route_type='1', route_number='100')
+        Station.objects.create(station_id='S1', station_name='100번지', local_x='126.5', local_y='33.5')
+        self.addCleanup(setattr, dataset, '_checked_at', None)
+        dataset.publish()
+        response = self.client.get('/autocomplete/?q=10&type=route&format=json')
+        self.assertEqual(response.json(), [{'type': 'route', 'id': 'R1', 'name': '100'}])
+        self.assertEqual(self.client.get('/autocomplete/?q=10&type=bus&format=json').status_code, 400)
+
+
+class PlannerTests(SimpleTestCase):
+
+    def setUp(self):
+        stations = ['A', 'B', 'C', 'D', 'E', 'F']
+        index = {station_id: i for i, station_id in enumerate(stations)}
+        trips = [(1, 'R1'), (2, 'R2'), (3, 'R2'), (4, 'R3')]
+
+        def connection(departure, arrival, from_station, to_station, trip):
+            return (departure * 60, arrival * 60, index[from_station], index[to_station], trip)
+        connections = [
+            # R1: A 08:00 -> B 08:10 -> C 08:20
+            connection(480, 490, 'A', 'B', 0), connection(490, 500, 'B', 'C', 0),
+            # R2 leaves C at 08:15, before R1 gets there, and again at 08:25.
+            connection(495, 510, 'C', 'D', 1), connection(505, 520, 'C', 'D', 2),
+            # R3: a slower ride from B to D.
+            connection(492, 530, 'B', 'D', 3),
+        ]
+        self.planner = Planner(stations, trips, {'1': Connections(connections)}, {},
+                               footpaths={index['D']: [(index['E'], 120)]})
+
+    def test_transfer(self):
+        legs = self.planner.plan('A', 'D', datetime.time(7, 55), '1')
+        self.assertEqual([(leg['trip_id'], leg['from_station_id'], leg['to_station_id'],
+                           leg['departure'], leg['arrival']) for leg in legs], [
+            (1, 'A', 'C', '08:00:00', '08:20:00'),
+            (3, 'C', 'D', '08:25:00', '08:40:00'),
+        ])
+
+    def test_walk_after_the_last_bus(self):
+        legs = self.planner.plan('A', 'E', datetime.time(7, 55), '1')
+        self.assertEqual([leg['type'] for leg in legs], ['bus', 'bus', 'walk'])
+        self.assertEqual((legs[-1]['departure'], legs[-1]['arrival']), ('08:40:00', '08:42:00'))
+
+    def test_missed_connection(self):
+        # The only bus from A has left.
+        self.assertIsNone(self.planner.plan('A', 'D', datetime.time(8, 1), '1'))
+
+    def test_no_route(self):
+        self.assertIsNone(self.planner.plan('D', 'A', datetime.time(7, 0), '1'))
+        self.assertIsNone(self.planner.plan('A', 'F', datetime.time(7, 0), '1'))
+        self.assertIsNone(self.planner.plan('A', 'D', datetime.time(7, 0), '2'))
+        self.assertIsNone(self.planner.plan('A', 'unknown', datetime.time(7, 0), '1'))
+
+    def test_same_station(self):
+        self.assertEqual(self.planner.plan('B', 'B', datetime.time(8, 0), '1'), [])
+
+    def test_reachable(self):
+        reached = self.planner.reachable('A', datetime.time(8, 0), 25 * 60, '1')
+        self.assertEqual([(row['station_id'], row['minutes']) for row in reached],
+                         [('A', 0), ('B', 10), ('C', 20)])
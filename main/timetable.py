@@ -0,0 +1,115 @@
+import bisect
+import datetime
+import heapq
+import itertools
+import sys
+from array import array
+
+from .dataset import DatasetIndex
+from .models import Departure, Route, Station
+
+
+def to_seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def from_seconds(s):
+    return datetime.time(s // 3600, s // 60 % 60, s % 60)
+
+
+class Timetable:
+    """Read-only departure times keyed by
+    (station_id, route_id, up_down_direction, holiday_type).
+
+    Each key maps to a sorted ``array`` of seconds since midnight, so a
+    "next departures" lookup is a bisect per route serving the station.
+    """
+
+    def __init__(self, stations, routes, times):
+        self.stations = stations
+        self.routes = routes
+        self.times = times
+        self.keys_by_station = {}
+        for key in sorted(times):
+            self.keys_by_station.setdefault(key[0], []).append(key)
+
+    @classmethod
+    def load(cls):
+        stations = frozenset(
+            Station.objects.values_list('station_id', flat=True))
+        routes = dict(Route.objects.values_list('route_id', 'route_number'))
+        grouped = {}
+        rows = Departure.objects.values_list(
+            'station_id', 'route_id', 'up_down_direction', 'holiday_type', 'time').order_by()
+        for station_id, route_id, up_down_direction, holiday_type, time in rows.iterator():
+            key = (station_id, route_id, up_down_direction, holiday_type)
+            grouped.setdefault(key, []).append(to_seconds(time))
+        times = {key: array('I', sorted(values))
+                 for key, values in grouped.items()}
+        return cls(stations, routes, times)
+
+    def next_departures(self, station_id, at, limit, holiday_type=None,
+                        route_id=None, up_down_direction=None):
+        start = to_seconds(at)
+        streams = []
+        for key in self.keys_by_station.get(station_id, ()):
+            if route_id is not None and key[1] != route_id:
+                continue
+            if up_down_direction is not None and key[2] != up_down_direction:
+                continue
+            if holiday_type is not None and key[3] != holiday_type:
+                continue
+            times = self.times[key]
+            i = bisect.bisect_left(times, start)
+            streams.append(zip(times[i:i + limit], itertools.repeat(key)))
+        return [{
+            'holiday_type': key[3],
+            'route_id': key[1],
+            'station_id': key[0],
+            'up_down_direction': key[2],
+            'time': from_seconds(seconds).isoformat(),
+        } for seconds, key in itertools.islice(heapq.merge(*streams), limit)]
+
+    def board(self, station_id, start, end, limit, holiday_type=None):
+        """Departures in [start, end] of every route serving the station,
+        grouped by (route_id, up_down_direction, holiday_type) and ordered
+        by each group's first departure."""
+        start, end = to_seconds(start), to_seconds(end)
+        groups = []
+        for key in self.keys_by_station.get(station_id, ()):
+            if holiday_type is not None and key[3] != holiday_type:
+                continue
+            times = self.times[key]
+            i = bisect.bisect_left(times, start)
+            j = min(bisect.bisect_right(times, end), i + limit)
+            if i == j:
+                continue
+            groups.append({
+                'route_id': key[1],
+                'route_number': self.routes.get(key[1]),
+                'up_down_direction': key[2],
+                'holiday_type': key[3],
+                'times': [from_seconds(seconds).isoformat() for seconds in times[i:j]],
+            })
+        groups.sort(key=lambda group: (group['times'][0], group['route_id'],
+                                       group['up_down_direction'], group['holiday_type']))
+        return groups
+
+    def footprint(self):
+        keys = sum(sys.getsizeof(key) + sum(sys.getsizeof(x) for x in key)
+                   for key in self.times)
+        arrays = sum(sys.getsizeof(times) for times in self.times.values())
+        index = sys.getsizeof(self.times) + sys.getsizeof(self.keys_by_station) + \
+            sum(sys.getsizeof(keys) for keys in self.keys_by_station.values())
+        stations = sys.getsizeof(self.stations) + \
+            sum(sys.getsizeof(x) for x in self.stations)
+        routes = sys.getsizeof(self.routes) + \
+            sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.routes.items())
+        return {
+            'keys': len(self.times),
+            'departures': sum(len(times) for times in self.times.values()),
+            'bytes': keys + arrays + index + stations + routes,
+        }
+
+
+timetable = DatasetIndex(Timetable.load)
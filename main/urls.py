@@ -8,10 +8,15 @@ router.register(r'stations', views.StationViewSet, basename='station')
 router.register(r'stationroutes', views.StationRouteViewSet,
                 basename='stationroute')
 router.register(r'times', views.TimeViewSet, basename='time')
+router.register(r'trips', views.TripViewSet, basename='trip')
+router.register(r'autocomplete', views.AutocompleteViewSet,
+                basename='autocomplete')
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     path('', include(router.urls)),
+    path('timetable/', views.TimetableView.as_view(), name='timetable'),
+    path('plan/', views.PlanView.as_view(), name='plan'),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -1,12 +1,219 @@
+import datetime
+import math
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from . import holidays
+from .caching import ConditionalGetMixin, ResponseCacheMixin
+from .renderers import NDJSONRenderer, StreamingJSONRenderer, encode_chunks
+from .geo import station_grid
+from .planner import planner
+from .search import autocomplete, station_search
+from .snapshot import snapshot
+from .serializers import (DepartureSerializer, RouteHeadwaySerializer, RouteSegmentSerializer, RouteSerializer,
+                          RouteSummarySerializer, StationSerializer, StationRouteSerializer, TransferSerializer,
+                          TripSerializer, TripStopSerializer)
+from .models import (Departure, Route, RouteHeadway, RouteSegment, RouteSummary, Station, StationRoute, Transfer,
+                     Trip)
+from .timetable import from_seconds, timetable, to_seconds
+
+NEXT_DEPARTURES_LIMIT = 10
+NEXT_DEPARTURES_MAX_LIMIT = 100
+BOARD_LIMIT = 5
+BOARD_MAX_LIMIT = 50
+BOARD_WINDOW = 3600  # seconds
+REACHABLE_WITHIN = 30  # minutes
+REACHABLE_MAX_WITHIN = 24 * 60
+NEARBY_RADIUS = 500  # meters
+NEARBY_MAX_RADIUS = 5000
+NEARBY_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+STATION_SEARCH_LIMIT = 20
+STATION_SEARCH_MAX_LIMIT = 100
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_TYPES = ('station', 'route')
+BATCH_MAX_IDS = 500
+BATCH_MAX_ROWS = 10000
+
+
+def get_time_param(query_params, name, default=None):
+    value = query_params.get(name, None)
+    if value is None:
+        return default
+    try:
+        return datetime.datetime.strptime(value, '%H:%M').time()
+    except ValueError:
+        raise ValidationError({name: 'Expected a time in HH:MM format.'})
+
+
+def get_holiday_type_param(query_params):
+    """``holiday_type``, or the holiday type that runs on ``date``."""
+    holiday_type = query_params.get('holiday_type', None)
+    value = query_params.get('date', None)
+    if value is None:
+        return holiday_type
+    if holiday_type is not None:
+        raise ValidationError(
+            {'date': 'Expected either date or holiday_type, not both.'})
+    try:
+        date = holidays.parse_date(value)
+    except ValueError:
+        raise ValidationError({'date': 'Expected a date in YYYY-MM-DD format.'})
+    try:
+        return holidays.holiday_type(date)
+    except ValueError:
+        raise ValidationError(
+            {'date': 'The holiday calendar does not cover {}.'.format(date.year)})
+
+
+def get_float_param(query_params, name):
+    value = query_params.get(name, None)
+    if value is None:
+        raise ValidationError({name: 'This parameter is required.'})
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected a number.'})
+    if not math.isfinite(number):
+        raise ValidationError({name: 'Expected a finite number.'})
+    return number
+
+
+def get_today_holiday_type():
+    try:
+        return holidays.holiday_type(timezone.localdate())
+    except ValueError:
+        raise ValidationError(
+            {'date': 'The holiday calendar does not cover today; give date or holiday_type.'})
+
+
+def get_positive_int_param(query_params, name, default, maximum):
+    value = query_params.get(name, None)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer.'})
+    if number < 1:
+        raise ValidationError({name: 'Expected a positive integer.'})
+    return min(number, maximum)
+
+
+def get_limit_param(query_params, default, maximum):
+    return get_positive_int_param(query_params, 'limit', default, maximum)
+
+
+class StreamingListMixin:
+    """Streams the whole, unpaginated list with ``?format=ndjson`` or
+    ``?format=jsonstream``.
 
-from .serializers import RouteSerializer, StationSerializer, StationRouteSerializer, TimeSerializer
-from .models import Route, Station, StationRoute, Time
+    Rows are read with a chunked server-side iterator and rendered as they
+    are produced, so memory use does not grow with the result size.
+    ``limit`` still caps the number of rows.
+    """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
+        [NDJSONRenderer, StreamingJSONRenderer]
 
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not getattr(renderer, 'streaming', False):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer_class = self.get_serializer_class()
+        limit = self.paginator.get_limit(request) if self.paginator is not None else None
+        if limit is not None:
+            queryset = queryset[:limit]
+        if isinstance(queryset, QuerySet):
+            queryset = queryset.iterator(chunk_size=settings.STREAM_CHUNK_SIZE)
+        rows = (serializer_class.to_representation(row) for row in queryset)
+        return StreamingHttpResponse(
+            encode_chunks(renderer.render_stream(rows),
+                          settings.STREAM_CHUNK_SIZE),
+            content_type=renderer.media_type)
 
-class RouteViewSet(viewsets.ModelViewSet):
+
+class BatchLookupMixin:
+    """Adds a ``batch`` action that looks up many ids of one
+    ``batch_keys`` filter at once and returns the rows keyed by id.
+
+    Ids are given as repeated or comma-separated query parameters, e.g.
+    ``?station_id=A,B&station_id=C``; the other ``batch_filters`` take a
+    single value as in ``list``. By default the rows come from
+    ``batch_model`` in one query however many ids are given; viewsets
+    that can answer from elsewhere override ``get_batch_rows``.
+
+    ``limit`` caps the rows of each id. A response that would hold more
+    than ``BATCH_MAX_ROWS`` rows in total is rejected.
+    """
+    batch_model = None
+    batch_keys = ()
+    batch_filters = ()
+    conditional_actions = ConditionalGetMixin.conditional_actions + ('batch',)
+    cached_actions = ResponseCacheMixin.cached_actions + ('batch',)
+
+    def get_batch_rows(self, key, ids, filters, limit):
+        """Rows of ``ids`` ordered by ``key``, then by ``ordering``, read
+        lazily. They may ignore ``limit``, which ``batch`` enforces."""
+        queryset = self.batch_model.objects.filter(**{key + '__in': ids}, **filters)
+        return self.get_serializer_class().values(queryset.order_by(key, *self.ordering)).iterator()
+
+    @action(detail=False)
+    def batch(self, request):
+        given = {}
+        for key in self.batch_keys:
+            ids = list(dict.fromkeys(id for value in request.query_params.getlist(key)
+                                     for id in value.split(',') if id))
+            if ids:
+                given[key] = ids
+        # The key with several ids is the one looked up; any other
+        # single-valued key is an ordinary filter.
+        keys = [key for key, ids in given.items() if len(ids) > 1] or list(given)[:1]
+        if len(keys) != 1:
+            raise ValidationError('Expected the ids of exactly one of {}.'.format(
+                ', '.join(self.batch_keys)))
+        key = keys[0]
+        ids = given.pop(key)
+        if len(ids) > BATCH_MAX_IDS:
+            raise ValidationError(
+                {key: 'Expected at most {} ids.'.format(BATCH_MAX_IDS)})
+        filters = {name: request.query_params[name] for name in self.batch_filters
+                   if name not in self.batch_keys and name in request.query_params}
+        filters.update((name, ids[0]) for name, ids in given.items())
+        limit = self.paginator.get_limit(request) if self.paginator is not None else None
+        grouped = {id: [] for id in ids}
+        total = 0
+        for row in self.get_batch_rows(key, ids, filters, limit):
+            rows = grouped[row[key]]
+            if limit is not None and len(rows) >= limit:
+                continue
+            total += 1
+            if total > BATCH_MAX_ROWS:
+                raise ValidationError('The response would hold more than {} rows; pass a smaller limit or '
+                                      'fewer ids.'.format(BATCH_MAX_ROWS))
+            rows.append(row)
+        serializer_class = self.get_serializer_class()
+        return Response({id: [serializer_class.to_representation(row) for row in rows]
+                         for id, rows in grouped.items()})
+
+
+class RouteViewSet(ConditionalGetMixin, ResponseCacheMixin, viewsets.ModelViewSet):
     serializer_class = RouteSerializer
     http_method_names = ['get']
+    ordering = ('route_number', 'route_id')
+    conditional_actions = ConditionalGetMixin.conditional_actions + ('summary',)
+    cached_actions = ResponseCacheMixin.cached_actions + ('summary',)
 
     def get_queryset(self):
         queryset = Route.objects.all()
@@ -16,26 +223,148 @@ class RouteViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(route_type=route_type)
         if route_number is not None:
             queryset = queryset.filter(route_number__icontains=route_number)
-        queryset = queryset.order_by('route_number')
-        return queryset
+        queryset = queryset.order_by(*self.ordering)
+        return RouteSerializer.values(queryset)
+
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        """Service span, hourly headways and stop-to-stop travel times of
+        the route, as materialized by updatedb."""
+        route = self.get_object()
+        holiday_type = get_holiday_type_param(request.query_params)
+        filters = {'route_id': route['route_id']}
+        if holiday_type is not None:
+            filters['holiday_type'] = holiday_type
+        headways = {}
+        for row in RouteHeadway.objects.filter(**filters).order_by('hour').values(
+                'holiday_type', 'up_down_direction', *RouteHeadwaySerializer.fields):
+            headways.setdefault((row['holiday_type'], row['up_down_direction']), []).append(
+                RouteHeadwaySerializer.to_representation(row))
+        services = []
+        for row in RouteSummary.objects.filter(**filters).order_by('holiday_type', 'up_down_direction').values(
+                *RouteSummarySerializer.fields):
+            service = RouteSummarySerializer.to_representation(row)
+            service['headways'] = headways.get((row['holiday_type'], row['up_down_direction']), [])
+            services.append(service)
+        segments = RouteSegment.objects.filter(**filters).order_by(
+            'holiday_type', 'from_station_order', 'to_station_order').values(*RouteSegmentSerializer.fields)
+        data = RouteSerializer.to_representation(route)
+        data['services'] = services
+        data['segments'] = RouteSegmentSerializer(segments, many=True).data
+        return Response(data)
 
 
-class StationViewSet(viewsets.ModelViewSet):
+class StationViewSet(ConditionalGetMixin, ResponseCacheMixin, viewsets.ModelViewSet):
     serializer_class = StationSerializer
     http_method_names = ['get']
+    ordering = ('station_name', 'station_id')
+    conditional_actions = ConditionalGetMixin.conditional_actions + \
+        ('nearby', 'transfers')
+    cached_actions = ResponseCacheMixin.cached_actions + \
+        ('nearby', 'transfers')
 
     def get_queryset(self):
         queryset = Station.objects.all()
         station_name = self.request.query_params.get('station_name', None)
         if station_name is not None:
             queryset = queryset.filter(station_name__icontains=station_name)
-        queryset = queryset.order_by('station_name')
-        return queryset
+        queryset = queryset.order_by(*self.ordering)
+        return StationSerializer.values(queryset)
 
+    @action(detail=False)
+    def nearby(self, request):
+        x = get_float_param(request.query_params, 'x')
+        y = get_float_param(request.query_params, 'y')
+        radius = get_positive_int_param(
+            request.query_params, 'radius', NEARBY_RADIUS, NEARBY_MAX_RADIUS)
+        limit = get_limit_param(
+            request.query_params, NEARBY_LIMIT, NEARBY_MAX_LIMIT)
+        include_routes = request.query_params.get('routes', None) in ('1', 'true')
+        grid = station_grid.get()
+        stations = []
+        for distance, row in grid.nearby(x, y, radius, limit):
+            station = StationSerializer.to_representation(row)
+            station['distance'] = round(distance, 1)
+            if include_routes:
+                station['routes'] = grid.routes.get(row['station_id'], [])
+            stations.append(station)
+        return Response(stations)
 
-class StationRouteViewSet(viewsets.ModelViewSet):
+    @action(detail=True)
+    def transfers(self, request, pk=None):
+        if not Station.objects.filter(station_id=pk).exists():
+            raise Http404
+        transfers = Transfer.objects.filter(from_station_id=pk).order_by(
+            'walk_time', 'to_station_id').values(*TransferSerializer.fields)
+        return Response(TransferSerializer(transfers, many=True).data)
+
+    @action(detail=True)
+    def reachable(self, request, pk=None):
+        if not Station.objects.filter(station_id=pk).exists():
+            raise Http404
+        at = get_time_param(request.query_params, 'at',
+                            timezone.localtime().time())
+        within = get_positive_int_param(
+            request.query_params, 'within', REACHABLE_WITHIN, REACHABLE_MAX_WITHIN)
+        holiday_type = get_holiday_type_param(request.query_params) or get_today_holiday_type()
+        engine = planner.get()
+        stations = engine.reachable(pk, at, within * 60, holiday_type)
+        if request.query_params.get('coordinates', None) in ('1', 'true'):
+            for station in stations:
+                station['local_x'], station['local_y'] = engine.coordinates.get(
+                    station['station_id'], (None, None))
+        return Response(stations)
+
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('q', None)
+        if query is None:
+            return super().list(request, *args, **kwargs)
+        limit = get_limit_param(
+            request.query_params, STATION_SEARCH_LIMIT, STATION_SEARCH_MAX_LIMIT)
+        rows = station_search.get().search(query, limit)
+        return Response(StationSerializer(rows, many=True).data)
+
+    @action(detail=True, url_path='next')
+    def next_departures(self, request, pk=None):
+        table = timetable.get()
+        if pk not in table.stations:
+            raise Http404
+        at = get_time_param(request.query_params, 'at',
+                            timezone.localtime().time())
+        limit = get_limit_param(
+            request.query_params, NEXT_DEPARTURES_LIMIT, NEXT_DEPARTURES_MAX_LIMIT)
+        return Response(table.next_departures(
+            pk, at, limit,
+            holiday_type=get_holiday_type_param(request.query_params) or get_today_holiday_type(),
+            route_id=request.query_params.get('route_id', None),
+            up_down_direction=request.query_params.get('up_down_direction', None)))
+
+    @action(detail=True)
+    def board(self, request, pk=None):
+        table = timetable.get()
+        if pk not in table.stations:
+            raise Http404
+        start = get_time_param(request.query_params, 'at',
+                               timezone.localtime().time())
+        end = get_time_param(request.query_params, 'until', from_seconds(
+            min(to_seconds(start) + BOARD_WINDOW, to_seconds(datetime.time.max))))
+        if end < start:
+            raise ValidationError({'until': 'Expected a time not before at.'})
+        limit = get_limit_param(
+            request.query_params, BOARD_LIMIT, BOARD_MAX_LIMIT)
+        return Response(table.board(
+            pk, start, end, limit,
+            holiday_type=get_holiday_type_param(request.query_params) or get_today_holiday_type()))
+
+
+class StationRouteViewSet(BatchLookupMixin, ConditionalGetMixin, ResponseCacheMixin, StreamingListMixin, viewsets.ModelViewSet):
     serializer_class = StationRouteSerializer
     http_method_names = ['get']
+    ordering = ('station_order', 'id')
+    batch_model = StationRoute
+    batch_keys = ('route_id', 'station_id')
+    batch_filters = ('route_id', 'station_id',
+                     'station_order', 'up_down_direction')
 
     def get_queryset(self):
         queryset = StationRoute.objects.all()
@@ -44,38 +373,168 @@ class StationRouteViewSet(viewsets.ModelViewSet):
         station_order = self.request.query_params.get('station_order', None)
         up_down_direction = self.request.query_params.get(
             'up_down_direction', None)
+        if self.action == 'list' and (route_id is None) != (station_id is None) and station_order is None:
+            table = snapshot.get()
+            if table is not None:
+                return table.station_routes(
+                    route_id=route_id, station_id=station_id, up_down_direction=up_down_direction)
         if route_id is not None:
-            queryset = queryset.filter(route__route_id=route_id)
+            queryset = queryset.filter(route_id=route_id)
         if station_id is not None:
-            queryset = queryset.filter(station__station_id=station_id)
+            queryset = queryset.filter(station_id=station_id)
         if station_order is not None:
             queryset = queryset.filter(station_order=station_order)
         if up_down_direction is not None:
             queryset = queryset.filter(up_down_direction=up_down_direction)
-        queryset = queryset.order_by('station_order')
-        return queryset
+        queryset = queryset.order_by(*self.ordering)
+        return StationRouteSerializer.values(queryset)
+
+    def get_batch_rows(self, key, ids, filters, limit):
+        station_order = filters.get('station_order', None)
+        if station_order is not None:
+            if not station_order.isdigit():
+                raise ValidationError(
+                    {'station_order': 'Expected a non-negative integer.'})
+            filters['station_order'] = int(station_order)
+        table = snapshot.get()
+        if table is not None and set(filters) <= {'up_down_direction'}:
+            return (row for id in ids
+                    for row in islice(table.station_routes(**{key: id}, **filters), limit))
+        return super().get_batch_rows(key, ids, filters, limit)
 
 
-class TimeViewSet(viewsets.ModelViewSet):
-    serializer_class = TimeSerializer
+class TimeViewSet(BatchLookupMixin, ConditionalGetMixin, ResponseCacheMixin, StreamingListMixin, viewsets.ModelViewSet):
+    """Departures, optionally narrowed to the holiday type running on
+    ``date`` and to the times in [``after``, ``before``)."""
+    serializer_class = DepartureSerializer
     http_method_names = ['get']
+    ordering = ('time', 'id')
+    batch_model = Departure
+    batch_keys = ('route_id', 'station_id')
+    batch_filters = ('route_id', 'station_id', 'up_down_direction')
+
+    def get_time_filters(self):
+        query_params = self.request.query_params
+        return {
+            'holiday_type': get_holiday_type_param(query_params),
+            'after': get_time_param(query_params, 'after'),
+            'before': get_time_param(query_params, 'before'),
+        }
+
+    def get_time_lookups(self, holiday_type, after, before):
+        lookups = {}
+        if holiday_type is not None:
+            lookups['holiday_type'] = holiday_type
+        if after is not None:
+            lookups['time__gte'] = after
+        if before is not None:
+            lookups['time__lt'] = before
+        return lookups
 
     def get_queryset(self):
-        queryset = Time.objects.all()
-        holiday_type = self.request.query_params.get('holiday_type', None)
+        queryset = Departure.objects.all()
+        time_filters = self.get_time_filters()
         route_id = self.request.query_params.get('route_id', None)
         station_id = self.request.query_params.get('station_id', None)
         up_down_direction = self.request.query_params.get(
             'up_down_direction', None)
-        if holiday_type is not None:
-            queryset = queryset.filter(holiday_type=holiday_type)
+        if self.action == 'list' and (route_id is None) != (station_id is None):
+            table = snapshot.get()
+            if table is not None:
+                return table.departures(
+                    station_id=station_id, route_id=route_id,
+                    up_down_direction=up_down_direction, **time_filters)
+        queryset = queryset.filter(**self.get_time_lookups(**time_filters))
         if route_id is not None:
-            queryset = queryset.filter(station_route__route__route_id=route_id)
+            queryset = queryset.filter(route_id=route_id)
         if station_id is not None:
-            queryset = queryset.filter(
-                station_route__station__station_id=station_id)
+            queryset = queryset.filter(station_id=station_id)
         if up_down_direction is not None:
-            queryset = queryset.filter(
-                station_route__up_down_direction=up_down_direction)
-        queryset = queryset.order_by('time')
-        return queryset
+            queryset = queryset.filter(up_down_direction=up_down_direction)
+        queryset = queryset.order_by(*self.ordering)
+        return DepartureSerializer.values(queryset)
+
+    def get_batch_rows(self, key, ids, filters, limit):
+        time_filters = self.get_time_filters()
+        table = snapshot.get()
+        if table is not None and set(filters) <= {'up_down_direction'}:
+            return (row for id in ids
+                    for row in islice(table.departures(**{key: id}, **filters, **time_filters), limit))
+        return super().get_batch_rows(key, ids, dict(filters, **self.get_time_lookups(**time_filters)), limit)
+
+
+class TripViewSet(ConditionalGetMixin, ResponseCacheMixin, viewsets.ModelViewSet):
+    """Bus runs; a single trip also lists its stops in route order."""
+    serializer_class = TripSerializer
+    http_method_names = ['get']
+    ordering = ('id',)
+
+    def get_queryset(self):
+        queryset = Trip.objects.all()
+        route_id = self.request.query_params.get('route_id', None)
+        holiday_type = get_holiday_type_param(self.request.query_params)
+        up_down_direction = self.request.query_params.get(
+            'up_down_direction', None)
+        if route_id is not None:
+            queryset = queryset.filter(route_id=route_id)
+        if holiday_type is not None:
+            queryset = queryset.filter(holiday_type=holiday_type)
+        if up_down_direction is not None:
+            queryset = queryset.filter(up_down_direction=up_down_direction)
+        queryset = queryset.order_by(*self.ordering)
+        return TripSerializer.values(queryset)
+
+    def retrieve(self, request, *args, **kwargs):
+        trip = self.get_object()
+        stops = Departure.objects.filter(trip_id=trip['id']).order_by(
+            'station_order', 'time').values(*TripStopSerializer.fields)
+        data = TripSerializer.to_representation(trip)
+        data['stops'] = [TripStopSerializer.to_representation(row) for row in stops]
+        return Response(data)
+
+
+class AutocompleteViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    http_method_names = ['get']
+
+    def list(self, request):
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type', None)
+        if kind is not None and kind not in AUTOCOMPLETE_TYPES:
+            raise ValidationError(
+                {'type': 'Expected one of {}.'.format(', '.join(AUTOCOMPLETE_TYPES))})
+        limit = get_limit_param(
+            request.query_params, AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT)
+        return Response(autocomplete.get().complete(query, limit, kind=kind))
+
+
+class PlanView(APIView):
+    """Earliest-arrival itinerary between two stations."""
+    http_method_names = ['get']
+
+    def get(self, request):
+        origin = request.query_params.get('from', None)
+        destination = request.query_params.get('to', None)
+        if origin is None or destination is None:
+            raise ValidationError('Expected from and to station ids.')
+        at = get_time_param(request.query_params, 'at',
+                            timezone.localtime().time().replace(second=0, microsecond=0))
+        holiday_type = get_holiday_type_param(request.query_params) or get_today_holiday_type()
+        legs = planner.get().plan(origin, destination, at, holiday_type)
+        if legs is None:
+            raise NotFound('No itinerary found.')
+        return Response({
+            'from': origin,
+            'to': destination,
+            'holiday_type': holiday_type,
+            'departure': legs[0]['departure'] if legs else at.isoformat(),
+            'arrival': legs[-1]['arrival'] if legs else at.isoformat(),
+            'legs': legs,
+        })
+
+
+class TimetableView(APIView):
+    http_method_names = ['get']
+
+    def get(self, request):
+        table = timetable.get()
+        return Response(dict(version=timetable.version, **table.footprint()))